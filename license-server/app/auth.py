@@ -9,23 +9,41 @@ from app.config import settings
 SECRET_KEY = settings.ADMIN_SECRET_KEY
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 
+# Loại token phiên đăng nhập admin; token loại khác (ví dụ license token) không được chấp nhận
+ACCESS_TOKEN_TYPE = "admin"
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def create_access_token(data: dict):
     to_encode = data.copy()
+    to_encode["typ"] = ACCESS_TOKEN_TYPE
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_signed_token(claims: dict, expires_at: datetime, secret: str = SECRET_KEY, algorithm: str = ALGORITHM) -> str:
+    """Ký một JWT với các claim tùy ý và thời điểm hết hạn cho trước (`secret` là khóa bí mật PEM với ES256/RS256)."""
+    to_encode = claims.copy()
+    to_encode.update({"exp": expires_at})
+    return jwt.encode(to_encode, secret, algorithm=algorithm)
+
+def decode_signed_token(token: str, secret: str = SECRET_KEY, algorithm: str = ALGORITHM) -> dict:
+    """
+    Kiểm tra chữ ký và hạn của JWT, trả về claim. Ném JWTError nếu không hợp lệ.
+    Chỉ chấp nhận đúng một thuật toán, để token HS256 ký bằng khóa công khai không lọt qua.
+    """
+    return jwt.decode(token, secret, algorithms=[algorithm])
+
 async def get_current_user(request: Request):
     """Dependency này chỉ đọc token từ cookie một cách an toàn."""
     token = request.cookies.get("access_token")
     if not token:
         return None
     try:
-        jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return True
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
-        return None
\ No newline at end of file
+        return None
+    if claims.get("typ") != ACCESS_TOKEN_TYPE:
+        return None
+    return True
\ No newline at end of file
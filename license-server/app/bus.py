@@ -0,0 +1,315 @@
+# app/bus.py
+
+"""
+Bus sự kiện giữa các worker (gunicorn chạy nhiều tiến trình, mỗi tiến trình có cache/index/presence riêng).
+Service publish sự kiện sau khi commit; mỗi worker nhận và áp dụng vào trạng thái trong bộ nhớ của mình.
+
+Backend:
+- "postgres": LISTEN/NOTIFY trên chính database, không cần dịch vụ ngoài.
+- "local": Unix datagram socket trong một thư mục chung; dùng cho SQLite, chạy trên một máy và khi test.
+- "none": chỉ một tiến trình, không gửi gì.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import queue
+import secrets
+import select
+import socket
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Hashable
+from .config import settings
+
+CHANNEL = "license_events"
+# Sự kiện nội bộ khi có thể đã lỡ sự kiện (mất kết nối LISTEN): handler nên xóa cache
+RESYNC = "_resync"
+
+_handlers: dict[str, list[Callable[[list], None]]] = {}
+
+def subscribe(event: str, handler: Callable[[list], None]) -> None:
+    """Đăng ký handler nhận danh sách item của sự kiện `event` (chạy trên thread của bus)."""
+    _handlers.setdefault(event, []).append(handler)
+
+def dispatch(event: str, items: list) -> None:
+    for handler in _handlers.get(event, ()):
+        try:
+            handler(items)
+        except Exception as e:
+            print(f"ERROR: Bus handler for '{event}' failed. Reason: {e}")
+
+class Bus:
+    """
+    Phần chung của các backend: hàng đợi gửi (publish không bao giờ chặn request),
+    gom các sự kiện tần suất cao theo chu kỳ, chia payload và phân phối sự kiện nhận được.
+    """
+
+    name = "none"
+    # Kích thước tối đa của một payload (byte)
+    max_payload = 60_000
+
+    def __init__(self):
+        self.origin = f"{os.getpid()}-{secrets.token_hex(3)}"
+        self._outbox: queue.SimpleQueue = queue.SimpleQueue()
+        self._coalesced: dict[str, dict[Hashable, Any]] = {}
+        self._coalesced_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        self._open()
+        for target in (self._send_loop, self._receive_loop):
+            thread = threading.Thread(target=target, name=f"bus-{target.__name__}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._outbox.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._close()
+
+    def publish(self, event: str, items: list) -> None:
+        self._outbox.put((event, items))
+
+    def publish_coalesced(self, event: str, key: Hashable, item: Any, merge: Callable[[Any, Any], Any] | None = None) -> None:
+        """Gom theo `key` (mặc định giữ item mới nhất) và gửi một lần mỗi BUS_BATCH_INTERVAL_MS."""
+        with self._coalesced_lock:
+            pending = self._coalesced.setdefault(event, {})
+            previous = pending.get(key)
+            pending[key] = merge(previous, item) if merge is not None and previous is not None else item
+
+    def _flush_coalesced(self) -> None:
+        with self._coalesced_lock:
+            coalesced, self._coalesced = self._coalesced, {}
+        for event, pending in coalesced.items():
+            self._send_event(event, list(pending.values()))
+
+    def _send_loop(self) -> None:
+        interval = settings.BUS_BATCH_INTERVAL_MS / 1000
+        next_flush = time.monotonic() + interval
+        while True:
+            try:
+                message = self._outbox.get(timeout=max(0.0, next_flush - time.monotonic()))
+            except queue.Empty:
+                message = ()
+            if message is None:
+                self._flush_coalesced()
+                return
+            if message:
+                self._send_event(*message)
+            if time.monotonic() >= next_flush:
+                self._flush_coalesced()
+                next_flush = time.monotonic() + interval
+
+    def _send_event(self, event: str, items: list) -> None:
+        for payload in self._encode(event, items):
+            try:
+                self._send(payload)
+            except Exception as e:
+                print(f"ERROR: Could not publish bus event '{event}'. Reason: {e}")
+
+    def _encode(self, event: str, items: list) -> list[str]:
+        """Chia danh sách item thành các payload JSON không vượt quá max_payload."""
+        head = json.dumps({"origin": self.origin, "event": event})[:-1] + ', "items": ['
+        payloads, current, size = [], [], len(head) + 2
+        for item in items:
+            encoded = json.dumps(item, separators=(",", ":"))
+            if current and size + len(encoded) + 1 > self.max_payload:
+                payloads.append(head + ",".join(current) + "]}")
+                current, size = [], len(head) + 2
+            current.append(encoded)
+            size += len(encoded) + 1
+        if current:
+            payloads.append(head + ",".join(current) + "]}")
+        return payloads
+
+    def _deliver(self, payload: str | bytes) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("origin") != self.origin:
+            dispatch(message["event"], message["items"])
+
+    # --- Phần riêng của từng backend ---
+
+    def _open(self) -> None:
+        pass
+
+    def _close(self) -> None:
+        pass
+
+    def _send(self, payload: str) -> None:
+        pass
+
+    def _receive_loop(self) -> None:
+        self._stopping.wait()
+
+class PostgresBus(Bus):
+    """LISTEN/NOTIFY: một connection psycopg2 riêng để nghe, một connection riêng để gửi."""
+
+    name = "postgres"
+    # Giới hạn payload của NOTIFY là 8000 byte
+    max_payload = 7900
+
+    def __init__(self, engine):
+        super().__init__()
+        self._engine = engine
+        self._listen_conn = None
+        self._send_conn = None
+
+    def _connect(self):
+        # Tách connection khỏi pool: connection này sống suốt vòng đời của worker
+        pooled = self._engine.raw_connection()
+        conn = pooled.driver_connection
+        pooled.detach()
+        conn.autocommit = True
+        return conn
+
+    def _listen(self) -> None:
+        self._listen_conn = self._connect()
+        with self._listen_conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+
+    def _open(self) -> None:
+        self._listen()
+        self._send_conn = self._connect()
+
+    def _close(self) -> None:
+        for conn in (self._listen_conn, self._send_conn):
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+    def _send(self, payload: str) -> None:
+        try:
+            with self._send_conn.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+        except Exception:
+            # Kết nối gửi có thể đã bị đóng (restart DB, timeout): mở lại và thử một lần nữa
+            self._send_conn = self._connect()
+            with self._send_conn.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+
+    def _receive_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                if select.select([self._listen_conn], [], [], 1.0) == ([], [], []):
+                    continue
+                self._listen_conn.poll()
+                while self._listen_conn.notifies:
+                    self._deliver(self._listen_conn.notifies.pop(0).payload)
+            except Exception as e:
+                if self._stopping.is_set():
+                    return
+                print(f"ERROR: Bus LISTEN connection lost, reconnecting. Reason: {e}")
+                time.sleep(1)
+                try:
+                    self._listen()
+                except Exception:
+                    continue
+                # Có thể đã lỡ sự kiện trong lúc mất kết nối
+                dispatch(RESYNC, [])
+
+class LocalSocketBus(Bus):
+    """
+    Mỗi worker bind một Unix datagram socket `<pid>.sock` trong thư mục chung và gửi tới mọi socket khác.
+    Socket của worker đã chết (ConnectionRefused) được dọn khi gửi.
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        self._recv_sock: socket.socket | None = None
+        self._send_sock: socket.socket | None = None
+
+    def _open(self) -> None:
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._recv_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._recv_sock.bind(self.path)
+        self._recv_sock.settimeout(1.0)
+        self._send_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def _close(self) -> None:
+        for sock in (self._recv_sock, self._send_sock):
+            if sock is not None:
+                sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _send(self, payload: str) -> None:
+        data = payload.encode()
+        for name in os.listdir(self.directory):
+            peer = os.path.join(self.directory, name)
+            if not name.endswith(".sock") or peer == self.path:
+                continue
+            try:
+                self._send_sock.sendto(data, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(peer)
+                except FileNotFoundError:
+                    pass
+
+    def _receive_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                data = self._recv_sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self._deliver(data)
+
+def default_socket_dir(database_url: str) -> str:
+    # Các worker dùng chung DB thì dùng chung thư mục socket
+    digest = hashlib.sha1(database_url.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"license-server-bus-{digest}")
+
+_bus: Bus | None = None
+
+def start(engine) -> str:
+    """Khởi động bus theo BUS_BACKEND (auto: Postgres nếu DB là Postgres, ngược lại là local). Trả về tên backend."""
+    global _bus
+    if _bus is not None:
+        return _bus.name
+    backend = settings.BUS_BACKEND
+    if backend == "auto":
+        backend = "postgres" if engine.dialect.name == "postgresql" else "local"
+    if backend == "postgres":
+        bus = PostgresBus(engine)
+    elif backend == "local":
+        bus = LocalSocketBus(settings.BUS_SOCKET_DIR or default_socket_dir(str(engine.url)))
+    else:
+        return "none"
+    bus.start()
+    _bus = bus
+    return bus.name
+
+def stop() -> None:
+    global _bus
+    if _bus is not None:
+        _bus.stop()
+        _bus = None
+
+def publish(event: str, items: list) -> None:
+    """Gửi sự kiện tới các worker khác (không chặn; bỏ qua nếu bus chưa chạy)."""
+    if _bus is not None and items:
+        _bus.publish(event, items)
+
+def publish_coalesced(event: str, key: Hashable, item: Any, merge: Callable[[Any, Any], Any] | None = None) -> None:
+    """Như publish nhưng gom theo `key` trong BUS_BATCH_INTERVAL_MS, dùng cho sự kiện tần suất cao."""
+    if _bus is not None:
+        _bus.publish_coalesced(event, key, item, merge)
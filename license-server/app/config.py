@@ -4,10 +4,79 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     # Đọc DATABASE_URL do Render cung cấp
     DATABASE_URL: str
-    
+
     # Các biến khác giữ nguyên
     ADMIN_SECRET_KEY: str = "default_secret_key"
 
+    # Cache key cho luồng /activate
+    KEY_CACHE_MAX_SIZE: int = 50_000
+    KEY_CACHE_TTL_SEC: int = 60
+
+    # Chu kỳ chạy bộ quét key hết hạn
+    EXPIRY_SWEEP_INTERVAL_SEC: int = 60
+
+    # Heartbeat: thời gian coi là mất kết nối và chu kỳ xả buffer xuống DB
+    HEARTBEAT_TIMEOUT_SEC: int = 90
+    HEARTBEAT_FLUSH_INTERVAL_SEC: int = 15
+
+    # License token ký sẵn: xác thực lại không cần DB; thu hồi có hiệu lực tối đa sau TTL.
+    # Ký bất đối xứng (ES256 hoặc RS256): server giữ khóa bí mật (PEM, trực tiếp hoặc qua file),
+    # client chỉ cần khóa công khai (GET /license-token/public-key) để kiểm tra token khi offline.
+    # Tạo khóa: openssl genpkey -algorithm EC -pkeyopt ec_paramgen_curve:P-256 -out license_token.pem
+    # Không cấu hình khóa thì server không cấp license token.
+    LICENSE_TOKEN_PRIVATE_KEY: str | None = None
+    LICENSE_TOKEN_PRIVATE_KEY_FILE: str | None = None
+    LICENSE_TOKEN_ALGORITHM: str = "ES256"
+    LICENSE_TOKEN_TTL_MIN: int = 60
+    # Thời gian client được phép dùng token đã hết hạn khi mất kết nối tới server
+    LICENSE_TOKEN_OFFLINE_GRACE_SEC: int = 72 * 3600
+
+    # Giới hạn tần suất cho /activate và /heartbeat (token bucket, đơn vị: yêu cầu/phút)
+    RATE_LIMIT_IP_PER_MIN: float = 600
+    RATE_LIMIT_IP_BURST: float = 120
+    RATE_LIMIT_MACHINE_PER_MIN: float = 60
+    RATE_LIMIT_MACHINE_BURST: float = 30
+    RATE_LIMIT_KEY_PREFIX_PER_MIN: float = 30
+    RATE_LIMIT_KEY_PREFIX_BURST: float = 20
+    # Số token bị trừ thêm cho mỗi lần kích hoạt thất bại
+    RATE_LIMIT_FAILURE_COST: float = 5
+    # Số định danh tối đa mỗi bộ giới hạn giữ trong bộ nhớ (LRU)
+    RATE_LIMIT_MAX_ENTRIES: int = 100_000
+    # Giới hạn theo IP dùng địa chỉ của kết nối (request.client). Khi chạy sau proxy (như Render),
+    # server phải được khởi động để tự thay địa chỉ đó bằng IP client do proxy gửi, ví dụ:
+    #   uvicorn app.main:app --proxy-headers --forwarded-allow-ips="<IP của proxy>"
+    #   gunicorn app.main:app -k uvicorn.workers.UvicornWorker --forwarded-allow-ips="<IP của proxy>"
+    # Nếu không, mọi yêu cầu đều mang IP của proxy và giới hạn theo IP thành một giới hạn chung cho
+    # tất cả client; khi đó hãy tắt cờ này (giới hạn theo máy và dải key vẫn áp dụng).
+    RATE_LIMIT_BY_IP: bool = True
+    FAILED_ATTEMPTS_FLUSH_INTERVAL_SEC: int = 30
+    # Chu kỳ đối soát bảng key_stats với bảng key
+    STATS_RECONCILE_INTERVAL_SEC: int = 3600
+
+    # Số liệu hiệu năng (/metrics) và nhật ký truy vấn chậm
+    METRICS_ENABLED: bool = True
+    SLOW_QUERY_MS: float = 200
+    SLOW_QUERY_LOG_SIZE: int = 100
+    # Thêm header Server-Timing (thời gian DB, số truy vấn) vào mọi response
+    SERVER_TIMING_ENABLED: bool = False
+
+    # Bus đồng bộ trạng thái trong bộ nhớ giữa các worker: auto | postgres | local | none
+    BUS_BACKEND: str = "auto"
+    # Thư mục chứa Unix socket của backend "local" (mặc định: thư mục tạm, theo DATABASE_URL)
+    BUS_SOCKET_DIR: str | None = None
+    # Chu kỳ gom các sự kiện tần suất cao (presence, phạt rate limit)
+    BUS_BATCH_INTERVAL_MS: int = 200
+
+    # Cache HTML đã render của từng hàng trong bảng key ở trang admin
+    ROW_FRAGMENT_CACHE_SIZE: int = 20_000
+    ROW_FRAGMENT_CACHE_TTL_SEC: int = 24 * 3600
+
+    # Nhật ký sự kiện kích hoạt: hàng đợi trong bộ nhớ, ghi theo lô vào phân vùng theo ngày
+    EVENT_LOG_QUEUE_SIZE: int = 50_000
+    EVENT_LOG_FLUSH_INTERVAL_SEC: int = 2
+    # Số ngày giữ lại; phân vùng cũ hơn bị DROP nguyên bảng
+    EVENT_LOG_RETENTION_DAYS: int = 30
+
     class Config:
         env_file = ".env"
 
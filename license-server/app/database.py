@@ -1,28 +1,68 @@
 # app/database.py
 
+from __future__ import annotations
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from . import metrics
+
+def to_async_url(url: str) -> str:
+    """Đổi chuỗi kết nối đồng bộ sang driver async tương ứng."""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
 
 # Lấy chuỗi kết nối từ biến môi trường của Render
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Nếu biến này không tồn tại, in ra lỗi và dừng lại
-if not DATABASE_URL:
-    print("="*80)
-    print("FATAL ERROR: Environment variable 'DATABASE_URL' is not set.")
-    print("Please go to your service's 'Environment' tab on Render and add it.")
-    print("="*80)
-    # Dừng chương trình ở đây để tránh các lỗi không mong muốn
-    # raise ValueError("DATABASE_URL is not set") # Dùng print thay vì raise để đảm bảo log được ghi lại
-    engine = None
-else:
-    # Nếu biến tồn tại, tạo engine
+# Engine được tạo trong lifespan của FastAPI (init_engine), không phải lúc import,
+# để việc import module (script, worker gunicorn) không tốn kết nối tới DB.
+engine = None
+async_engine = None
+
+# Tạo một lớp Session để tương tác với DB (đồng bộ, dùng cho script và tác vụ nền)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+# Session bất đồng bộ: không chặn event loop của uvicorn khi chờ DB
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+def init_engine(database_url: str | None = None):
+    """Tạo engine đồng bộ và async (chỉ một lần) rồi gắn vào các sessionmaker."""
+    global engine, async_engine, DATABASE_URL
+    if engine is not None:
+        return engine
+    DATABASE_URL = database_url or DATABASE_URL
+    # Nếu biến này không tồn tại, in ra lỗi và dừng lại
+    if not DATABASE_URL:
+        print("="*80)
+        print("FATAL ERROR: Environment variable 'DATABASE_URL' is not set.")
+        print("Please go to your service's 'Environment' tab on Render and add it.")
+        print("="*80)
+        return None
     engine = create_engine(DATABASE_URL)
+    # Engine bất đồng bộ cho các route async (asyncpg / aiosqlite)
+    async_engine = create_async_engine(to_async_url(DATABASE_URL))
+    metrics.instrument_pool(engine.pool)
+    metrics.instrument_pool(async_engine.pool)
+    SessionLocal.configure(bind=engine)
+    AsyncSessionLocal.configure(bind=async_engine)
+    return engine
 
-# Tạo một lớp Session để tương tác với DB
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async def dispose_engine():
+    """Đóng các connection pool khi tiến trình dừng."""
+    global engine, async_engine
+    if async_engine is not None:
+        await async_engine.dispose()
+    if engine is not None:
+        engine.dispose()
+    engine = None
+    async_engine = None
 
 # Base class cho các lớp model
 Base = declarative_base()
@@ -37,6 +77,13 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Hàm dependency async của FastAPI để cung cấp một AsyncSession."""
+    if async_engine is None:
+        raise Exception("Database engine is not initialized due to missing DATABASE_URL.")
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def check_database_connection():
     """
     Hàm này sẽ cố gắng kết nối tới DB và báo cáo kết quả.
@@ -1,14 +1,6 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from .config import settings
-
-# Use sync SQLite for simplicity; for Postgres, point DATABASE_URL to postgres and remove replace()
-engine = create_engine(settings.DATABASE_URL.replace("+aiosqlite", ""), future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Dùng chung session với app/database.py thay vì tạo một engine thứ hai.
+# Engine được tạo trong lifespan (database.init_engine), nên chỉ re-export sessionmaker/dependency.
+from .database import (  # noqa: F401
+    SessionLocal, get_db,
+    AsyncSessionLocal, get_async_db,
+)
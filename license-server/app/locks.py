@@ -0,0 +1,102 @@
+# app/locks.py
+
+"""
+Khóa dùng chung giữa các worker (gunicorn chạy nhiều tiến trình trên cùng một database).
+Postgres: advisory lock theo id. SQLite/khác: file lock (fcntl) cạnh file database.
+"""
+
+from __future__ import annotations
+import contextlib
+import fcntl
+import os
+import tempfile
+import threading
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+def _lock_path(engine: Engine, name: str) -> str:
+    database = engine.url.database
+    if database and database != ":memory:":
+        return f"{os.path.abspath(database)}.{name}.lock"
+    return os.path.join(tempfile.gettempdir(), f"license-server.{name}.lock")
+
+@contextlib.contextmanager
+def exclusive(engine: Engine, lock_id: int, name: str):
+    """Chờ tới khi giữ được khóa `lock_id`/`name`, nhả ra khi ra khỏi khối with."""
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": lock_id})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": lock_id})
+        return
+    with open(_lock_path(engine, name), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class LeaderLock:
+    """
+    Khóa "trưởng nhóm": worker nào lấy được (không chờ) thì giữ tới khi dừng, các worker khác
+    thử lại ở lần gọi sau và chỉ lấy được khi worker đang giữ đã thoát.
+    """
+
+    def __init__(self, lock_id: int, name: str):
+        self.lock_id = lock_id
+        self.name = name
+        self._conn: Connection | None = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def acquire(self, engine: Engine) -> bool:
+        """True nếu tiến trình này đang (hoặc vừa) giữ khóa."""
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    # Mất kết nối thì Postgres đã tự nhả khóa: bỏ kết nối cũ và thử lấy lại
+                    self._conn.execute(text("SELECT 1"))
+                    return True
+                except Exception:
+                    self._close()
+            if self._file is not None:
+                return True
+            if engine.dialect.name == "postgresql":
+                conn = engine.connect()
+                try:
+                    acquired = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": self.lock_id}).scalar()
+                    conn.commit()
+                except Exception:
+                    conn.close()
+                    raise
+                if acquired:
+                    self._conn = conn
+                else:
+                    conn.close()
+                return bool(acquired)
+            lock_file = open(_lock_path(engine, self.name), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return False
+            self._file = lock_file
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        # Đóng kết nối/file là đủ để nhả khóa (advisory lock theo session, flock theo file)
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
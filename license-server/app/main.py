@@ -1,45 +1,67 @@
 # app/main.py
 
 import sys
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
-from sqlalchemy import text
+from fastapi.responses import PlainTextResponse, RedirectResponse
+
+# Mốc thời gian để đo tổng thời gian khởi động của worker
+_BOOT_STARTED = time.perf_counter()
 
 # Import các thành phần cần thiết
-from .database import engine
-from . import models
+from . import bus, database, metrics
+from .config import settings
+from .schema import bootstrap_schema
 from .routers import admin_web, admin_api, client_api
+from .scheduler import start_scheduler, shutdown_scheduler
+from .services import license_tokens, presence
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tạo engine và kiểm tra schema trong lifespan thay vì lúc import module.
+    # Schema đã cập nhật thì bootstrap chỉ tốn một câu SELECT, không chạy DDL.
+    engine = database.init_engine()
+    if engine is None:
+        sys.exit(1)
+    schema_started = time.perf_counter()
+    try:
+        schema_state = bootstrap_schema(engine)
+    except Exception as e:
+        print(f"FATAL: Could not bootstrap database schema. Error: {e}")
+        sys.exit(1)
+    schema_ms = (time.perf_counter() - schema_started) * 1000
+
+    # Bus đồng bộ cache/presence/... với các worker khác
+    try:
+        bus_backend = bus.start(engine)
+    except Exception as e:
+        print(f"WARNING: Could not start the worker bus, running without cross-worker sync. Error: {e}")
+        bus_backend = "none"
 
-# --- PHẦN MÃ DỌN DẸP DATABASE TRIỆT ĐỂ ---
-print("="*80)
-print("RUNNING FINAL DATABASE CLEANUP SCRIPT...")
-try:
-    with engine.connect() as connection:
-        print("Connecting to the database to drop old types and tables...")
-        # Lệnh này sẽ xóa kiểu dữ liệu 'keystatus' và BẤT KỲ THỨ GÌ phụ thuộc vào nó (như bảng 'keys')
-        # Đây là cách làm triệt để nhất.
-        connection.execute(text("DROP TYPE IF EXISTS keystatus CASCADE;"))
-        connection.commit()
-        print("SUCCESS: Old 'keystatus' type and dependent objects (like 'keys' table) have been dropped.")
-except Exception as e:
-    print(f"ERROR: Could not perform cleanup. Reason: {e}")
-    sys.exit(1)
-print("="*80)
-# --- KẾT THÚC PHẦN MÃ DỌN DẸP ---
-
-
-# Lệnh này sẽ tạo lại TẤT CẢ MỌI THỨ từ đầu một cách sạch sẽ
-try:
-    print("Re-creating all tables and types from scratch with the correct schema...")
-    models.Base.metadata.create_all(bind=engine)
-    print("SUCCESS: All tables and types have been recreated correctly.")
-except Exception as e:
-    print(f"FATAL: Could not create new tables. Error: {e}")
-    sys.exit(1)
+    if not license_tokens.signing_enabled():
+        print("WARNING: LICENSE_TOKEN_PRIVATE_KEY is not set; /activate will not issue license tokens.")
 
+    # Bộ quét key hết hạn chạy nền cùng vòng đời của ứng dụng
+    start_scheduler()
+    # Timing wheel của presence registry tick trên chính event loop
+    presence_ticker = asyncio.create_task(presence.run_ticker())
+    boot_ms = (time.perf_counter() - _BOOT_STARTED) * 1000
+    print(f"Application startup complete: worker {os.getpid()} ready in {boot_ms:.0f} ms "
+          f"(schema {schema_state} in {schema_ms:.0f} ms, bus {bus_backend}).")
+    yield
+    presence_ticker.cancel()
+    shutdown_scheduler()
+    bus.stop()
+    await database.dispose_engine()
 
 # Khởi tạo ứng dụng FastAPI như bình thường
-app = FastAPI(title="License Server")
+app = FastAPI(title="License Server", lifespan=lifespan)
+if settings.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware, server_timing=settings.SERVER_TIMING_ENABLED)
 app.include_router(admin_web.router)
 app.include_router(admin_api.router)
 app.include_router(client_api.router)
@@ -48,4 +70,7 @@ app.include_router(client_api.router)
 async def root():
     return RedirectResponse(url="/admin/keys")
 
-print("Application startup complete.")
\ No newline at end of file
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Số liệu cho Prometheus: độ trễ theo route, số truy vấn/thời gian DB mỗi request, chờ pool."""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,242 @@
+# app/metrics.py
+
+from __future__ import annotations
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .config import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    """Histogram kiểu Prometheus (bucket cộng dồn, _sum, _count) theo từng bộ nhãn."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # nhãn -> [số mẫu theo bucket (không cộng dồn) ..., tổng, số lượng]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items()]
+        for labels, (counts, total, count) in sorted(items):
+            base = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{base} {total}")
+            lines.append(f"{self.name}_count{base} {count}")
+        return lines
+
+class Counter:
+    """Bộ đếm kiểu Prometheus theo từng bộ nhãn."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.label_names, labels)} {value}" for labels, value in items)
+        return lines
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Thời gian xử lý request theo route.", ("method", "route"))
+requests_total = Counter(
+    "http_requests_total", "Số request theo route và mã trạng thái.", ("method", "route", "status"))
+request_queries = Histogram(
+    "http_request_db_queries", "Số câu truy vấn DB trong mỗi request.", ("route",), QUERY_COUNT_BUCKETS)
+request_db_time = Histogram(
+    "http_request_db_seconds", "Tổng thời gian chờ DB trong mỗi request.", ("route",))
+query_duration = Histogram(
+    "db_query_duration_seconds", "Thời gian của từng câu truy vấn DB.")
+pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds", "Thời gian chờ lấy connection từ pool.")
+slow_queries_total = Counter(
+    "db_slow_queries_total", "Số câu truy vấn chậm hơn SLOW_QUERY_MS theo route.", ("route",))
+
+ALL_METRICS = (
+    request_duration, requests_total, request_queries, request_db_time,
+    query_duration, pool_checkout_wait, slow_queries_total,
+)
+
+# Nhật ký truy vấn chậm gần nhất (giới hạn kích thước)
+slow_query_log: deque[dict] = deque(maxlen=settings.SLOW_QUERY_LOG_SIZE)
+
+@dataclass
+class RequestStats:
+    """Số liệu DB của request hiện tại; là đối tượng thay đổi được để thread/greenlet con cùng ghi vào."""
+    scope: dict | None = None
+    queries: int = 0
+    db_seconds: float = 0.0
+    pool_wait_seconds: float = 0.0
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def route(self) -> str:
+        # Route chỉ biết được sau khi router khớp đường dẫn (FastAPI ghi vào scope["route"])
+        return _route_label(self.scope) if self.scope is not None else "background"
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+# --- Hook SQLAlchemy: áp dụng cho mọi Engine (kể cả sync_engine bên trong AsyncEngine) ---
+
+# Thời điểm bắt đầu lưu trên execution context (mỗi câu lệnh một context) chứ không trên connection:
+# câu lệnh lỗi không gọi after_cursor_execute, nên dữ liệu gắn với connection trong pool sẽ tồn đọng mãi.
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    query_duration.observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+    if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+        route = stats.route if stats is not None else "background"
+        slow_queries_total.inc(route)
+        slow_query_log.append({
+            "at": datetime.now(timezone.utc).isoformat(),
+            "route": route,
+            "duration_ms": round(elapsed * 1000, 2),
+            "statement": statement,
+        })
+        print(f"SLOW QUERY: {elapsed * 1000:.1f} ms on {route}: {' '.join(statement.split())[:500]}")
+
+def _record_pool_wait(elapsed: float) -> None:
+    pool_checkout_wait.observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait_seconds += elapsed
+
+def instrument_pool(pool) -> None:
+    """
+    Đo thời gian chờ lấy connection từ pool. SQLAlchemy không có event trước khi checkout,
+    nên đổi lớp của pool sang lớp con bọc _do_get (pool.recreate() giữ nguyên lớp này).
+    """
+    base = type(pool)
+    if getattr(base, "_timed", False):
+        return
+
+    class TimedPool(base):
+        _timed = True
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                _record_pool_wait(time.perf_counter() - started)
+
+    TimedPool.__name__ = TimedPool.__qualname__ = f"Timed{base.__name__}"
+    pool.__class__ = TimedPool
+
+# --- Middleware ASGI ---
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path_format", None) or getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI thuần (không dùng BaseHTTPMiddleware để không làm hỏng SSE/streaming):
+    đo thời gian mỗi request, đếm truy vấn DB và (tùy chọn) thêm header Server-Timing.
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(scope=scope)
+        token = _current.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (b"server-timing", _server_timing(stats).encode("latin-1"))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            route = stats.route
+            elapsed = time.perf_counter() - stats.started
+            request_duration.observe(elapsed, scope["method"], route)
+            requests_total.inc(scope["method"], route, str(status_code))
+            request_queries.observe(stats.queries, route)
+            request_db_time.observe(stats.db_seconds, route)
+
+def _server_timing(stats: RequestStats) -> str:
+    total_ms = (time.perf_counter() - stats.started) * 1000
+    return (
+        f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries", '
+        f"pool;dur={stats.pool_wait_seconds * 1000:.2f}, "
+        f"app;dur={total_ms:.2f}"
+    )
+
+def render_prometheus() -> str:
+    """Xuất toàn bộ số liệu theo định dạng văn bản của Prometheus."""
+    lines: list[str] = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
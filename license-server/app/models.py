@@ -1,13 +1,15 @@
 # app/models.py
 
 from __future__ import annotations
-from sqlalchemy import Column, Integer, String, DateTime, Enum
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, Enum, Index, DDL, event, func
 from .database import Base
 import enum
 
 class KeyStatus(str, enum.Enum):
     unused = "unused"
     active = "active"
+    used = "used"
+    revoked = "revoked"
     expired = "expired"
 
 class Key(Base):
@@ -20,4 +22,42 @@ class Key(Base):
     key = Column(String, unique=True, index=True, nullable=False)
     status = Column(Enum(KeyStatus), default=KeyStatus.unused, nullable=False)
     expiry_date = Column(DateTime(timezone=True), nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default="now()", nullable=False)
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Thông tin kích hoạt phía client
+    machine_id = Column(String, nullable=True)
+    username = Column(String, nullable=True)
+    last_activated_at = Column(DateTime(timezone=True), nullable=True)
+    failed_attempts = Column(Integer, default=0, server_default="0", nullable=False)
+    # Tăng mỗi khi trạng thái/máy của key thay đổi; license token mang theo giá trị này
+    version = Column(Integer, default=1, server_default="1", nullable=False)
+
+    __table_args__ = (
+        # Phục vụ câu UPDATE hàng loạt của bộ quét key hết hạn
+        Index("ix_license_keys_final_expiry_status", "expiry_date", "status"),
+    )
+
+class KeyStat(Base):
+    """
+    Bộ đếm tổng hợp của bảng key, cập nhật trong cùng transaction với mỗi thay đổi (services/stats.py).
+    `bucket` là "status:<trạng thái>" hoặc "expires:<YYYY-MM-DD>" (số key còn hiệu lực hết hạn vào ngày đó, UTC).
+    """
+    __tablename__ = "key_stats"
+
+    bucket = Column(String, primary_key=True)
+    count = Column(BigInteger, default=0, server_default="0", nullable=False)
+
+# Tìm kiếm chuỗi con trên Postgres: index trigram (pg_trgm) trên key đã bỏ dấu '-'.
+# Biểu thức phải trùng với services/search.py::_normalized_key_column.
+KEY_TRGM_INDEX = "ix_license_keys_final_key_trgm"
+PG_TRGM_EXTENSION_DDL = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+KEY_TRGM_INDEX_DDL = DDL(
+    f"CREATE INDEX IF NOT EXISTS {KEY_TRGM_INDEX} "
+    "ON license_keys_final USING gin (replace(key, '-', '') gin_trgm_ops)"
+).execute_if(dialect="postgresql")
+event.listen(Key.__table__, "before_create", PG_TRGM_EXTENSION_DDL)
+event.listen(Key.__table__, "after_create", KEY_TRGM_INDEX_DDL)
+
+# Index chỉ có trên một dialect (tạo bằng DDL ở trên), dùng khi so schema thật với models
+DIALECT_INDEXES: dict[str, dict[str, tuple[str, ...]]] = {
+    "postgresql": {Key.__tablename__: (KEY_TRGM_INDEX,)},
+}
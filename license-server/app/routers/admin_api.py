@@ -1,20 +1,156 @@
 # app/routers/admin_api.py
 
 from __future__ import annotations # <--- Thêm dòng này vào đầu
-from fastapi import APIRouter, Depends, HTTPException
+import csv
+import io
+import json
+from typing import Iterator
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from ..database import get_db
+from ..database import get_db, SessionLocal
+from ..services import events as events_service
 from ..services import keys as key_service
-from .. import schemas
+from ..services import stats as stats_service
+from ..services.cache import etag_matches
+from .. import metrics, models, schemas
 
 router = APIRouter(
     prefix="/api/admin",
     tags=["Admin API"]
 )
 
+EXPORT_FIELDS = ["id", "key", "status", "expiry_date", "created_at"]
+
 @router.get("/keys", response_model=list[schemas.Key])
-def get_all_keys(db: Session = Depends(get_db)):
+def get_all_keys(
+    request: Request,
+    response: Response,
+    limit: int = Query(key_service.DEFAULT_PAGE_SIZE, ge=1, le=key_service.MAX_PAGE_SIZE),
+    after_id: int | None = Query(None, description="Chỉ trả về các key có id nhỏ hơn giá trị này"),
+    db: Session = Depends(get_db),
+):
+    """
+    API endpoint to list keys page by page (keyset pagination on id DESC).
+    The next page cursor is returned in the X-Next-After-Id header.
+    Responses carry an ETag shared by all workers; If-None-Match with the current one
+    returns 304 after a single primary-key lookup instead of the page query.
+    """
+    etag = key_service.table_etag(db)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    page = key_service.list_keys_page(db, limit=limit, after_id=after_id)
+    if len(page) == limit:
+        response.headers["X-Next-After-Id"] = str(page[-1].id)
+    return page
+
+def _export_row(key) -> dict:
+    return {
+        "id": key.id,
+        "key": key.key,
+        "status": key.status.value,
+        "expiry_date": key.expiry_date.isoformat() if key.expiry_date else None,
+        "created_at": key.created_at.isoformat() if key.created_at else None,
+    }
+
+def _iter_export(fmt: str) -> Iterator[str]:
+    """Sinh nội dung xuất theo từng lô; dùng session riêng vì response còn chạy sau khi request kết thúc."""
+    db = SessionLocal()
+    try:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS) if fmt == "csv" else None
+        if writer:
+            writer.writeheader()
+        for count, key in enumerate(key_service.iter_all_keys(db), start=1):
+            if writer:
+                writer.writerow(_export_row(key))
+            else:
+                buffer.write(json.dumps(_export_row(key)) + "\n")
+            if count % key_service.EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    finally:
+        db.close()
+
+@router.get("/keys/export")
+def export_keys(format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """
+    API endpoint to stream every key as NDJSON or CSV with flat memory usage.
+    """
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="keys.{format}"'}
+    return StreamingResponse(_iter_export(format), media_type=media_type, headers=headers)
+
+def _iter_mint(payload: schemas.BulkMintRequest) -> Iterator[str]:
+    """Tạo key theo lô và trả từng lô về client ngay sau khi commit."""
+    db = SessionLocal()
+    try:
+        for batch in key_service.iter_mint_keys(
+            db, payload.count, days_valid=payload.days_valid, status=payload.status
+        ):
+            yield "".join(json.dumps({"id": key_id, "key": key_value}) + "\n" for key_id, key_value in batch)
+    finally:
+        db.close()
+
+@router.post("/keys/bulk", response_model=schemas.BulkMintResult)
+def bulk_mint_keys(
+    payload: schemas.BulkMintRequest,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: Session = Depends(get_db),
+):
+    """
+    API endpoint to mint a batch of keys (up to 100k) with batched inserts.
+    Use format=ndjson to stream the created keys as each batch is committed.
+    """
+    if payload.status not in (models.KeyStatus.unused, models.KeyStatus.active):
+        raise HTTPException(status_code=400, detail="Only 'unused' or 'active' keys can be minted.")
+    if format == "ndjson":
+        return StreamingResponse(_iter_mint(payload), media_type="application/x-ndjson")
+    created = key_service.mint_keys(db, payload.count, days_valid=payload.days_valid, status=payload.status)
+    return {"created": len(created), "keys": [{"id": key_id, "key": key_value} for key_id, key_value in created]}
+
+@router.get("/keys/{key_id}/events")
+def get_key_events(
+    key_id: int,
+    response: Response,
+    limit: int = Query(events_service.DEFAULT_PAGE_SIZE, ge=1, le=events_service.MAX_PAGE_SIZE),
+    before: str | None = Query(None, description="Con trỏ trang lấy từ header X-Next-Before"),
+    db: Session = Depends(get_db),
+):
+    """
+    API endpoint to list a key's activation events, newest first.
+    Only the daily partitions up to the cursor's day are read; the next page cursor is in X-Next-Before.
+    """
+    try:
+        page, next_before = events_service.key_history(db, key_id, before, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid 'before' cursor.")
+    if next_before:
+        response.headers["X-Next-Before"] = next_before
+    return [{**event, "occurred_at": event["occurred_at"].isoformat()} for event in page]
+
+@router.get("/stats")
+def get_key_stats(db: Session = Depends(get_db)):
+    """
+    API endpoint to get key counts per status and keys expiring within 1/7/30 whole UTC days (today included).
+    Reads the key_stats summary table instead of scanning the keys.
+    """
+    return stats_service.summary(db)
+
+@router.get("/cache-stats")
+def get_cache_stats():
+    """
+    API endpoint to inspect the /activate key cache (hit/miss counters).
+    """
+    return key_service.key_cache.stats()
+
+@router.get("/slow-queries")
+def get_slow_queries():
     """
-    API endpoint to get all keys.
+    API endpoint to list the most recent slow queries with the route that issued them.
     """
-    return key_service.get_all_keys(db)
\ No newline at end of file
+    return list(reversed(metrics.slow_query_log))
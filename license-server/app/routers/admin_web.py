@@ -1,66 +1,180 @@
 # app/routers/admin_web.py
 
 from __future__ import annotations
+import asyncio
+import json
+from datetime import datetime, timezone
 from fastapi import APIRouter, Request, Depends, Form, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from markupsafe import Markup
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..database import get_db
+from ..database import get_async_db
+from ..services import events as events_service
 from ..services import keys as keys_service
+from ..services import keys_async
+from ..services import search as search_service
+from ..services import presence
 from .. import models
+from ..config import settings
+from ..services.cache import TTLCache, etag_matches
 
 router = APIRouter(prefix="/admin", tags=["Admin Web Interface"])
 templates = Jinja2Templates(directory="app/templates")
 
+# Cache HTML đã render của từng hàng, khóa theo (id, version, key): version tăng ở mọi thay đổi
+# của key nên một key thay đổi chỉ làm render lại đúng hàng đó; mục cũ tự bị đẩy ra theo LRU.
+row_cache = TTLCache(max_size=settings.ROW_FRAGMENT_CACHE_SIZE, ttl_seconds=settings.ROW_FRAGMENT_CACHE_TTL_SEC)
+
+def render_key_row(key) -> Markup:
+    """Render partials/keys_table_rows.html cho một key, dùng lại bản đã render nếu key chưa đổi."""
+    cache_key = (key.id, key.version, key.key)
+    html = row_cache.get(cache_key)
+    if html is None:
+        html = Markup(templates.get_template("partials/keys_table_rows.html").render(key=key))
+        row_cache.set(cache_key, html)
+    return html
+
+templates.env.globals["render_key_row"] = render_key_row
+
+def _not_modified(request: Request, etag: str) -> Response | None:
+    """Trả về 304 nếu trình duyệt đã có bản ứng với phiên bản bảng hiện tại."""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+def _with_etag(response: Response, etag: str) -> Response:
+    # no-cache: trình duyệt vẫn giữ bản sao nhưng luôn hỏi lại (If-None-Match) trước khi dùng
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+async def _keys_page_context(request: Request, db: AsyncSession, after_id: int | None = None) -> dict:
+    """Lấy một trang key (keyset) và id dùng để tải trang kế tiếp khi cuộn."""
+    page = await keys_async.list_keys_page(db, limit=keys_service.DEFAULT_PAGE_SIZE, after_id=after_id)
+    next_after_id = page[-1].id if len(page) == keys_service.DEFAULT_PAGE_SIZE else None
+    return {"request": request, "keys": page, "next_after_id": next_after_id}
+
 @router.get("/keys", response_class=HTMLResponse)
-async def keys_page(request: Request, db: Session = Depends(get_db)):
-    """Trang chính hiển thị bảng quản lý key."""
-    all_keys = keys_service.get_all_keys(db)
-    return templates.TemplateResponse("keys.html", {"request": request, "keys": all_keys})
+async def keys_page(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Trang chính hiển thị bảng quản lý key (chỉ trang đầu, phần còn lại tải khi cuộn)."""
+    # Lấy ETag trước khi truy vấn: nếu có ghi xen giữa, lần sau client chỉ tải lại thừa chứ không bị cũ.
+    # Số key sắp hết hạn đổi theo ngày nên ngày (UTC) cũng nằm trong ETag.
+    etag = await keys_async.table_etag(db, datetime.now(timezone.utc).date().isoformat())
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    context = await _keys_page_context(request, db)
+    context["summary"] = await keys_async.stats_summary(db)
+    return _with_etag(templates.TemplateResponse("keys.html", context), etag)
+
+@router.get("/keys/rows", response_class=HTMLResponse)
+async def htmx_more_keys(request: Request, after_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Trả về trang key tiếp theo cho cơ chế cuộn vô hạn của HTMX."""
+    etag = await keys_async.table_etag(db)
+    return _not_modified(request, etag) or _with_etag(
+        templates.TemplateResponse("partials/table_body.html", await _keys_page_context(request, db, after_id)), etag
+    )
 
 @router.post("/keys/search", response_class=HTMLResponse)
-async def htmx_search_keys(request: Request, search: str = Form(""), db: Session = Depends(get_db)):
+async def htmx_search_keys(
+    request: Request,
+    search: str = Form(""),
+    status: str = Form(""),
+    prefix: bool = Form(False),
+    limit: int = Form(search_service.DEFAULT_LIMIT),
+    db: AsyncSession = Depends(get_async_db),
+):
     """
-    Xử lý yêu cầu tìm kiếm từ HTMX và trả về toàn bộ tbody đã được render.
-    Cách tiếp cận này đơn giản và ổn định hơn.
+    Xử lý yêu cầu tìm kiếm từ HTMX và trả về tbody đã được render.
+    Tìm theo chuỗi con/tiền tố của key (bỏ qua dấu '-') qua services/search.py.
     """
-    if not search.strip():
-        # Nếu ô tìm kiếm trống, trả về tất cả key
-        found_keys = keys_service.get_all_keys(db)
-    else:
-        search_term = f"%{search.strip()}%"
-        query = db.query(models.Key).filter(
-            or_(
-                models.Key.key.ilike(search_term),
-                # Chuyển đổi Enum sang text để so sánh
-                models.Key.status.as_string().ilike(search_term)
-            )
-        ).order_by(models.Key.id.desc())
-        found_keys = query.all()
-
-    # Render lại toàn bộ bảng với dữ liệu đã lọc và chỉ trả về phần tbody
+    term = search.strip()
+    status_filter = models.KeyStatus(status) if status in models.KeyStatus.__members__ else None
+    # Giữ hành vi cũ: gõ đúng tên trạng thái thì lọc theo trạng thái
+    if status_filter is None and term.lower() in models.KeyStatus.__members__:
+        status_filter, term = models.KeyStatus(term.lower()), ""
+
+    if not term and status_filter is None:
+        # Nếu ô tìm kiếm trống, trả về trang đầu tiên như khi tải trang
+        return templates.TemplateResponse("partials/table_body.html", await _keys_page_context(request, db))
+
+    found_keys = await keys_async.search_keys(
+        db, term, status=status_filter, prefix=prefix,
+        limit=max(1, min(limit, search_service.MAX_LIMIT)),
+    )
+    # Render lại bảng với dữ liệu đã lọc và chỉ trả về phần tbody
     return templates.TemplateResponse("partials/table_body.html", {"request": request, "keys": found_keys})
 
 @router.post("/keys/create", response_class=HTMLResponse)
-async def htmx_create_key(request: Request, days_valid: int = Form(None), db: Session = Depends(get_db)):
+async def htmx_create_key(request: Request, days_valid: int = Form(None), db: AsyncSession = Depends(get_async_db)):
     """Tạo key mới và trả về HTML cho một hàng mới."""
-    new_key = keys_service.create_new_key(db, days_valid)
+    new_key = await keys_async.create_new_key(db, days_valid)
     return templates.TemplateResponse("partials/keys_table_rows.html", {"request": request, "key": new_key})
 
 @router.post("/keys/{key_id}/activate", response_class=HTMLResponse)
-async def htmx_activate_key(request: Request, key_id: int, db: Session = Depends(get_db)):
+async def htmx_activate_key(request: Request, key_id: int, db: AsyncSession = Depends(get_async_db)):
     """Kích hoạt key và trả về HTML của hàng đã được cập nhật."""
-    updated_key = keys_service.activate_key_by_id(db, key_id=key_id)
+    updated_key = await keys_async.activate_key_by_id(db, key_id=key_id)
     if not updated_key:
         raise HTTPException(status_code=400, detail="Key already used or not found.")
     return templates.TemplateResponse("partials/keys_table_rows.html", {"request": request, "key": updated_key})
 
 @router.delete("/keys/{key_id}", response_class=HTMLResponse)
-async def htmx_delete_key(key_id: int, db: Session = Depends(get_db)):
+async def htmx_delete_key(key_id: int, db: AsyncSession = Depends(get_async_db)):
     """Xóa một key và trả về response trống để HTMX xóa hàng."""
-    success = keys_service.delete_key_by_id(db, key_id=key_id)
+    success = await keys_async.delete_key_by_id(db, key_id=key_id)
     if not success:
         raise HTTPException(status_code=404, detail="Key not found to delete.")
-    return HTMLResponse(content="", status_code=200)
\ No newline at end of file
+    return HTMLResponse(content="", status_code=200)
+
+@router.get("/keys/{key_id}/history", response_class=HTMLResponse)
+async def key_history_page(request: Request, key_id: int, before: str | None = None, db: AsyncSession = Depends(get_async_db)):
+    """Lịch sử kích hoạt của một key, mới nhất trước; trang cũ hơn qua liên kết ?before=<con trỏ>."""
+    try:
+        page, next_before = await keys_async.key_history(db, key_id, before, events_service.DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid 'before' cursor.")
+    return templates.TemplateResponse("key_history.html", {
+        "request": request, "key_id": key_id, "events": page,
+        "next_before": next_before, "is_first_page": before is None,
+        "retention_days": settings.EVENT_LOG_RETENTION_DAYS,
+    })
+
+@router.get("/monitor", response_class=HTMLResponse)
+async def monitor_page(request: Request):
+    """Trang giám sát thiết bị online: ảnh chụp ban đầu từ presence registry, sau đó cập nhật qua SSE."""
+    return templates.TemplateResponse("monitor.html", {"request": request, "rows": _presence_rows()})
+
+def _presence_rows() -> list[dict]:
+    return [
+        {"key_id": e.key_id, "key": e.key, "machine_id": e.machine_id,
+         "last_seen": e.last_seen.strftime('%Y-%m-%d %H:%M:%S')}
+        for e in presence.registry.snapshot()
+    ]
+
+@router.get("/monitor/events")
+async def monitor_events(request: Request):
+    """
+    Server-Sent Events: đẩy các thay đổi online/offline thay vì để trang tự tải lại.
+    Tin nhắn đầu tiên là ảnh chụp toàn bộ danh sách, lấy SAU khi đăng ký nhận thay đổi,
+    để thay đổi xảy ra giữa lúc render trang và lúc EventSource kết nối (hoặc kết nối lại) không bị lỡ.
+    """
+    async def event_stream():
+        queue = presence.registry.subscribe()
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(_presence_rows())}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Giữ kết nối qua các proxy khi không có thay đổi
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {payload['event']}\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            presence.registry.unsubscribe(queue)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
@@ -1,11 +1,13 @@
 # app/routers/client_api.py
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Request
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import date
 
-from app.services import keys as key_service
-from app.database import get_db
+from app.services import keys_async as key_service
+from app.services import events, license_tokens, ratelimit
+from app.services.keys import ACTIVATION_BATCH_MAX, CONFLICT_DECISION, decide_activation
+from app.database import get_async_db
 from datetime import datetime, timezone
 
 router = APIRouter()
@@ -15,39 +17,153 @@ class KeyActivationRequest(BaseModel):
     machine_id: str
     username: str
 
-# Trong tệp app/routers/client_api.py
+class BatchActivationRequest(BaseModel):
+    entries: list[KeyActivationRequest] = Field(..., min_length=1, max_length=ACTIVATION_BATCH_MAX)
 
-# Trong tệp app/routers/client_api.py
+class HeartbeatRequest(BaseModel):
+    key: str
+    machine_id: str
+
+class TokenVerifyRequest(BaseModel):
+    token: str
+    machine_id: str
+
+def _license_token_fields(key_object, machine_id: str) -> dict:
+    """Các trường license token gửi kèm khi kích hoạt/xác thực lại thành công (không có nếu server chưa cấu hình khóa ký)."""
+    if not license_tokens.signing_enabled():
+        return {}
+    token, expires_at = license_tokens.issue_token(key_object, machine_id)
+    return {
+        "license_token": token,
+        "token_expires_at": expires_at.isoformat(),
+        "offline_grace_seconds": int(license_tokens.OFFLINE_GRACE.total_seconds()),
+    }
+
+def _client_ip(http_request: Request) -> str | None:
+    # Header proxy (X-Forwarded-For) do uvicorn/gunicorn xử lý khi khởi động đúng cờ (xem RATE_LIMIT_BY_IP)
+    return http_request.client.host if http_request.client else None
+
+def _too_many_requests(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Quá nhiều yêu cầu, vui lòng thử lại sau.",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+def _enforce_rate_limit(client_ip: str | None, machine_id: str, key_value: str) -> None:
+    """Từ chối (429) trước khi chạm DB nếu IP, máy hoặc dải key đang gửi quá nhiều yêu cầu."""
+    retry_after = ratelimit.check_request(client_ip, machine_id, key_value)
+    if retry_after is not None:
+        raise _too_many_requests(retry_after)
 
 @router.post("/activate", summary="Kích hoạt một key bản quyền")
-async def activate_license_key(request: KeyActivationRequest, db: Session = Depends(get_db)):
-    key_object = key_service.get_key_by_value(db, request.key)
-
-    if not key_object:
-        raise HTTPException(status_code=404, detail="Key không hợp lệ hoặc không tồn tại.")
-
-    # --- SỬA LẠI LOGIC SO SÁNH DATETIME ---
-    now = datetime.now(timezone.utc)
-    if key_object.expiration_date and key_object.expiration_date < now:
-        if key_object.status != "expired":
-            key_service.update_key_status(db, request.key, "expired")
-        raise HTTPException(status_code=403, detail=f"Key này đã hết hạn vào lúc {key_object.expiration_date.strftime('%H:%M %d-%m-%Y')}.")
-
-    # ... phần còn lại của hàm giữ nguyên ...
-    if key_object.status == 'revoked':
-        key_service.increment_failed_attempts(db, request.key)
-        raise HTTPException(status_code=403, detail="Key này đã bị quản trị viên tạm khóa.")
-    if key_object.status == 'used':
-        if key_object.machine_id == request.machine_id:
-            key_service.update_last_activated_time(db, request.key)
-            return {"status": "success", "message": "Key đã được xác thực lại trên máy này."}
+async def activate_license_key(request: KeyActivationRequest, http_request: Request, db: AsyncSession = Depends(get_async_db)):
+    client_ip = _client_ip(http_request)
+    _enforce_rate_limit(client_ip, request.machine_id, request.key)
+    try:
+        return await _activate(request, db, client_ip)
+    except HTTPException as e:
+        # Mỗi lần bị từ chối tốn thêm token, để việc dò key bị chặn sớm
+        if e.status_code in (403, 404):
+            ratelimit.record_failure(client_ip, request.machine_id, request.key)
+        raise
+
+async def _activate(request: KeyActivationRequest, db: AsyncSession, client_ip: str | None) -> dict:
+    key_object = await key_service.get_key_by_value(db, request.key)
+    decision = decide_activation(key_object, request.machine_id)
+    key_id = key_object.id if key_object else None
+    if decision.action == "expire":
+        await key_service.update_key_status(db, request.key, "expired")
+    elif decision.action == "fail":
+        await key_service.increment_failed_attempts(db, request.key)
+    elif decision.action == "revalidate":
+        await key_service.update_last_activated_time(db, request.key)
+    elif decision.action == "activate":
+        if await key_service.set_activation_details(db, key_value=request.key, machine_id=request.machine_id, username=request.username):
+            key_object = await key_service.get_key_by_value(db, request.key)
         else:
-            key_service.increment_failed_attempts(db, request.key)
-            raise HTTPException(status_code=403, detail="Key này đã được sử dụng trên một máy tính khác.")
-    if key_object.status == 'expired':
-        raise HTTPException(status_code=403, detail=f"Key này đã hết hạn vào lúc {key_object.expiration_date.strftime('%H:%M %d-%m-%Y')}.")
-    if key_object.status == 'active':
-        key_service.set_activation_details(db, key_value=request.key, machine_id=request.machine_id, username=request.username)
-        return {"status": "success", "message": "Kích hoạt thành công!"}
-    raise HTTPException(status_code=400, detail=f"Không thể kích hoạt key với trạng thái '{key_object.status}'.")
-    
\ No newline at end of file
+            # Một yêu cầu đồng thời đã kích hoạt key trước: không cấp token cho yêu cầu này
+            decision = CONFLICT_DECISION
+    events.record_decision(decision, key_id, request.key, request.machine_id, client_ip)
+    if not decision.ok:
+        raise HTTPException(status_code=decision.http_status, detail=decision.message)
+    return {
+        "status": "success", "message": decision.message,
+        **_license_token_fields(key_object, request.machine_id),
+    }
+
+@router.post("/activate/batch", summary="Kích hoạt hàng loạt key cho nhiều máy")
+async def activate_license_keys_batch(request: BatchActivationRequest, http_request: Request, db: AsyncSession = Depends(get_async_db)):
+    client_ip = _client_ip(http_request)
+    # Mỗi mục tốn một token IP như một /activate riêng: lô lớn không vượt được giới hạn dò key
+    admitted, retry_after = ratelimit.admit_client(client_ip, len(request.entries))
+    if retry_after is not None:
+        raise _too_many_requests(retry_after)
+
+    results: list[dict | None] = [None] * len(request.entries)
+    pending: list[tuple[int, KeyActivationRequest]] = []
+    for index, entry in enumerate(request.entries):
+        if index >= admitted or ratelimit.check_entry(entry.machine_id, entry.key) is not None:
+            results[index] = _batch_result(entry, 429, "Quá nhiều yêu cầu, vui lòng thử lại sau.")
+        else:
+            pending.append((index, entry))
+
+    outcomes = await key_service.activate_keys_batch(
+        db, [(entry.key, entry.machine_id, entry.username) for _, entry in pending]
+    ) if pending else []
+    for (index, entry), (decision, key_object) in zip(pending, outcomes):
+        events.record_decision(decision, key_object.id if key_object else None, entry.key, entry.machine_id, client_ip)
+        if decision.ok:
+            results[index] = _batch_result(entry, 200, decision.message, **_license_token_fields(key_object, entry.machine_id))
+        else:
+            if decision.http_status in (403, 404):
+                ratelimit.record_failure(client_ip, entry.machine_id, entry.key)
+            results[index] = _batch_result(entry, decision.http_status, decision.message)
+    succeeded = sum(1 for result in results if result["code"] == 200)
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+
+def _batch_result(entry: KeyActivationRequest, code: int, message: str, **extra) -> dict:
+    return {
+        "key": entry.key,
+        "machine_id": entry.machine_id,
+        "status": "success" if code == 200 else "error",
+        "code": code,
+        "message": message,
+        **extra,
+    }
+
+@router.post("/heartbeat", summary="Báo máy vẫn đang sử dụng key")
+async def heartbeat(request: HeartbeatRequest, http_request: Request, db: AsyncSession = Depends(get_async_db)):
+    client_ip = _client_ip(http_request)
+    _enforce_rate_limit(client_ip, request.machine_id, request.key)
+    # Đọc từ cache và ghi vào buffer trong bộ nhớ: heartbeat bình thường không chạm DB
+    key_object = await key_service.get_key_by_value(db, request.key)
+    if not key_object or key_object.status != 'used' or key_object.machine_id != request.machine_id:
+        ratelimit.record_failure(client_ip, request.machine_id, request.key)
+        if not key_object:
+            raise HTTPException(status_code=404, detail="Key không hợp lệ hoặc không tồn tại.")
+        raise HTTPException(status_code=403, detail="Key chưa được kích hoạt trên máy này.")
+    await key_service.update_last_activated_time(db, request.key)
+    return {"status": "ok"}
+
+def _require_token_signing() -> None:
+    if not license_tokens.signing_enabled():
+        raise HTTPException(status_code=503, detail="License tokens are not configured on this server.")
+
+@router.get("/license-token/public-key", summary="Khóa công khai để client tự kiểm tra license token khi offline")
+async def license_token_public_key():
+    _require_token_signing()
+    return {"algorithm": license_tokens.TOKEN_ALGORITHM, "public_key": license_tokens.PUBLIC_KEY}
+
+@router.post("/verify", summary="Xác thực license token đã ký (không truy vấn DB)")
+async def verify_license_token(request: TokenVerifyRequest):
+    _require_token_signing()
+    try:
+        claims = license_tokens.verify_token(request.token, machine_id=request.machine_id)
+    except license_tokens.TokenError as e:
+        raise HTTPException(status_code=401, detail=e.reason)
+    return {
+        "status": "valid",
+        "key_id": claims["kid"],
+        "expires_at": datetime.fromtimestamp(claims["exp"], timezone.utc).isoformat(),
+    }
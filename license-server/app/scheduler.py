@@ -0,0 +1,161 @@
+# app/scheduler.py
+
+from __future__ import annotations
+import functools
+from datetime import datetime, timezone
+from typing import Callable
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from . import database, locks
+from .config import settings
+from .database import SessionLocal
+from .services import keys as key_service
+from .services import events, heartbeats, license_tokens, ratelimit, stats
+
+# Bộ lập lịch chạy nền cho các tác vụ định kỳ (chạy trong thread riêng)
+scheduler = BackgroundScheduler(timezone="UTC")
+
+# Các tác vụ làm việc trên dữ liệu chung (quét hết hạn, đối soát key_stats, phân vùng nhật ký) chỉ cần
+# một worker chạy: worker giữ khóa này chạy chúng, các worker khác bỏ qua cho tới khi nó dừng.
+# Các tác vụ xả buffer/dọn dữ liệu trong bộ nhớ của từng worker vẫn chạy ở mọi worker.
+_LEADER_LOCK_ID = 0x4C4B5332  # "LKS2"
+leader_lock = locks.LeaderLock(_LEADER_LOCK_ID, "scheduler")
+
+def _on_leader(job: Callable[[], object]) -> Callable[[], None]:
+    """Bọc `job` để chỉ chạy trên worker đang giữ leader_lock."""
+    @functools.wraps(job)
+    def run() -> None:
+        try:
+            if not leader_lock.acquire(database.engine):
+                return
+        except Exception as e:
+            print(f"ERROR: Could not take the scheduler lock for {job.__name__}. Reason: {e}")
+            return
+        job()
+    return run
+
+def run_expiry_sweep() -> int:
+    """Quét và đánh dấu các key hết hạn; chỉ in ra khi có dòng thay đổi."""
+    db = SessionLocal()
+    try:
+        changed = key_service.expire_overdue_keys(db)
+        if changed:
+            print(f"Expiry sweep: {changed} key(s) marked as expired.")
+        return changed
+    except Exception as e:
+        print(f"ERROR: Expiry sweep failed. Reason: {e}")
+        return 0
+    finally:
+        db.close()
+
+def run_heartbeat_flush() -> int:
+    """Xả buffer heartbeat xuống DB theo lô."""
+    db = SessionLocal()
+    try:
+        return heartbeats.flush_heartbeats(db)
+    except Exception as e:
+        print(f"ERROR: Heartbeat flush failed. Reason: {e}")
+        return 0
+    finally:
+        db.close()
+
+def run_failed_attempts_flush() -> int:
+    """Xả bộ đếm số lần kích hoạt thất bại xuống DB theo lô."""
+    db = SessionLocal()
+    try:
+        return ratelimit.flush_failed_attempts(db)
+    except Exception as e:
+        print(f"ERROR: Failed-attempts flush failed. Reason: {e}")
+        return 0
+    finally:
+        db.close()
+
+def run_stats_reconcile() -> int:
+    """Đếm lại key_stats từ bảng key để sửa sai lệch (nếu có)."""
+    db = SessionLocal()
+    try:
+        drift = stats.reconcile(db)
+        if drift:
+            print(f"Stats reconcile: corrected {drift} drifted bucket(s).")
+        return drift
+    except Exception as e:
+        print(f"ERROR: Stats reconcile failed. Reason: {e}")
+        return 0
+    finally:
+        db.close()
+
+def run_event_log_flush() -> int:
+    """Ghi các sự kiện kích hoạt đang chờ xuống DB theo lô."""
+    db = SessionLocal()
+    try:
+        return events.flush_events(db)
+    except Exception as e:
+        print(f"ERROR: Event log flush failed. Reason: {e}")
+        return 0
+    finally:
+        db.close()
+
+def run_event_log_maintenance() -> list[str]:
+    """Tạo trước phân vùng nhật ký cho ngày mai và xóa các phân vùng quá hạn."""
+    db = SessionLocal()
+    try:
+        dropped = events.maintain_partitions(db)
+        if dropped:
+            print(f"Event log: dropped {len(dropped)} expired partition(s): {', '.join(dropped)}")
+        return dropped
+    except Exception as e:
+        print(f"ERROR: Event log maintenance failed. Reason: {e}")
+        return []
+    finally:
+        db.close()
+
+def start_scheduler():
+    """Đăng ký các tác vụ định kỳ và khởi động bộ lập lịch."""
+    scheduler.add_job(
+        _on_leader(run_expiry_sweep), "interval",
+        seconds=settings.EXPIRY_SWEEP_INTERVAL_SEC,
+        id="expiry_sweep", max_instances=1, coalesce=True,
+        next_run_time=datetime.now(timezone.utc),
+    )
+    scheduler.add_job(
+        run_heartbeat_flush, "interval",
+        seconds=settings.HEARTBEAT_FLUSH_INTERVAL_SEC,
+        id="heartbeat_flush", max_instances=1, coalesce=True,
+    )
+    scheduler.add_job(
+        run_failed_attempts_flush, "interval",
+        seconds=settings.FAILED_ATTEMPTS_FLUSH_INTERVAL_SEC,
+        id="failed_attempts_flush", max_instances=1, coalesce=True,
+    )
+    scheduler.add_job(
+        _on_leader(run_stats_reconcile), "interval",
+        seconds=settings.STATS_RECONCILE_INTERVAL_SEC,
+        id="stats_reconcile", max_instances=1, coalesce=True,
+    )
+    scheduler.add_job(
+        run_event_log_flush, "interval",
+        seconds=settings.EVENT_LOG_FLUSH_INTERVAL_SEC,
+        id="event_log_flush", max_instances=1, coalesce=True,
+    )
+    scheduler.add_job(
+        _on_leader(run_event_log_maintenance), "interval",
+        hours=1, id="event_log_maintenance", max_instances=1, coalesce=True,
+        next_run_time=datetime.now(timezone.utc),
+    )
+    scheduler.add_job(
+        license_tokens.revocations.prune, "interval",
+        minutes=5, id="revocation_prune", max_instances=1, coalesce=True,
+    )
+    scheduler.start()
+
+def shutdown_scheduler():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    leader_lock.release()
+    # Xả nốt các heartbeat còn trong bộ nhớ trước khi tiến trình dừng
+    flushed = run_heartbeat_flush()
+    print(f"Shutdown: flushed {flushed} pending heartbeat(s).")
+    flushed = run_failed_attempts_flush()
+    print(f"Shutdown: flushed failed-attempt counters for {flushed} key(s).")
+    flushed = run_event_log_flush()
+    print(f"Shutdown: flushed {flushed} pending activation event(s).")
@@ -0,0 +1,196 @@
+# app/schema.py
+
+from __future__ import annotations
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Callable
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, UniqueConstraint, inspect, literal, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from . import locks, models
+
+# Bảng ghi lại phiên bản schema đã áp dụng; nằm ngoài models.Base để không bị migration xóa
+schema_meta = MetaData()
+schema_version_table = Table(
+    "schema_version", schema_meta,
+    Column("id", Integer, primary_key=True),
+    Column("version", Integer, nullable=False),
+    Column("fingerprint", String(64), nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+# Khóa advisory của Postgres dùng chung cho mọi worker khi chạy migration
+_ADVISORY_LOCK_ID = 0x4C4B5331  # "LKS1"
+
+def _column_default_sql(conn: Connection, column: Column) -> str | None:
+    """Giá trị DEFAULT dạng SQL của một cột (server_default, hoặc default Python là hằng số)."""
+    if column.server_default is not None:
+        arg = column.server_default.arg
+        return arg if isinstance(arg, str) else str(arg.compile(dialect=conn.dialect))
+    if column.default is not None and column.default.is_scalar:
+        return str(literal(column.default.arg, column.type).compile(
+            dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    return None
+
+def _prepare_enum_types(engine: Engine) -> None:
+    """
+    Postgres: tạo kiểu enum keystatus nếu chưa có và thêm các giá trị mới vào kiểu cũ (unused/active/expired).
+    Chạy trên connection AUTOCOMMIT riêng, TRƯỚC transaction migration: giá trị enum vừa thêm
+    không được dùng trong chính transaction đã thêm nó ("unsafe use of new value"), mà migration 2 lọc theo chúng.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    status_type = models.Key.__table__.c.status.type
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        status_type.create(bind=conn, checkfirst=True)
+        for value in models.KeyStatus:
+            conn.execute(text(f"ALTER TYPE {status_type.name} ADD VALUE IF NOT EXISTS '{value.value}'"))
+
+def _upgrade_keys_table(conn: Connection) -> None:
+    """
+    Đưa bảng license_keys_final về đúng models.Key mà không mất dữ liệu: tạo bảng nếu chưa có;
+    nếu đã có (bản triển khai cũ) thì thêm các cột và index còn thiếu bằng ALTER TABLE / CREATE INDEX.
+    Chạy lại nhiều lần không thay đổi gì.
+    """
+    table = models.Key.__table__
+    inspector = inspect(conn)
+    if not inspector.has_table(table.name):
+        table.create(bind=conn)
+        return
+    quote = conn.dialect.identifier_preparer.quote
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(dialect=conn.dialect)}"
+        default = _column_default_sql(conn, column)
+        if default is not None:
+            ddl += f" DEFAULT {default}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+        conn.execute(text(ddl))
+    for index in table.indexes:
+        index.create(bind=conn, checkfirst=True)
+    if conn.dialect.name == "postgresql":
+        conn.execute(models.PG_TRGM_EXTENSION_DDL)
+        conn.execute(models.KEY_TRGM_INDEX_DDL)
+
+def _migration_0001_rebuild(conn: Connection) -> None:
+    """Tạo hoặc nâng cấp tại chỗ bảng license_keys_final (giữ nguyên dữ liệu của bản triển khai cũ)."""
+    _upgrade_keys_table(conn)
+
+def _migration_0002_key_stats(conn: Connection) -> None:
+    """Tạo bảng key_stats và đếm lần đầu từ dữ liệu hiện có."""
+    from .services import stats
+    models.KeyStat.__table__.create(bind=conn, checkfirst=True)
+    stats.rebuild(conn)
+
+def _migration_0003_activation_events(conn: Connection) -> None:
+    """Tạo bảng cha phân vùng theo ngày cho nhật ký kích hoạt (chỉ Postgres; phân vùng con tạo khi cần)."""
+    from .services import events
+    events.create_parent_table(conn)
+
+# Danh sách migration theo thứ tự; chỉ thêm vào cuối, không sửa migration đã phát hành
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "create or upgrade license_keys_final", _migration_0001_rebuild),
+    (2, "add key_stats summary table", _migration_0002_key_stats),
+    (3, "add partitioned activation_events log", _migration_0003_activation_events),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _model_shapes(dialect: str) -> dict[str, dict | None]:
+    """Cấu trúc mong đợi của các bảng trong models: cột (tên, nullable), khóa chính, index (tên, unique)."""
+    shapes: dict[str, dict | None] = {}
+    for table in models.Base.metadata.sorted_tables:
+        indexes = {(index.name, bool(index.unique)) for index in table.indexes}
+        indexes |= {(name, False) for name in models.DIALECT_INDEXES.get(dialect, {}).get(table.name, ())}
+        shapes[table.name] = {
+            "columns": sorted((column.name, bool(column.nullable)) for column in table.columns),
+            "primary_key": sorted(column.name for column in table.primary_key.columns),
+            "indexes": sorted(indexes),
+            "unique": sorted(
+                sorted(column.name for column in constraint.columns)
+                for constraint in table.constraints if isinstance(constraint, UniqueConstraint)
+            ),
+        }
+    return shapes
+
+def _live_shapes(conn: Connection) -> dict[str, dict | None]:
+    """Cấu trúc thật (đọc từ catalog của database) của các bảng trong models; None nếu bảng không tồn tại."""
+    inspector = inspect(conn)
+    existing = set(inspector.get_table_names())
+    shapes: dict[str, dict | None] = {}
+    for table in models.Base.metadata.sorted_tables:
+        if table.name not in existing:
+            shapes[table.name] = None
+            continue
+        shapes[table.name] = {
+            "columns": sorted((column["name"], bool(column["nullable"])) for column in inspector.get_columns(table.name)),
+            "primary_key": sorted(inspector.get_pk_constraint(table.name)["constrained_columns"]),
+            "indexes": sorted(
+                (index["name"], bool(index["unique"])) for index in inspector.get_indexes(table.name)
+                # Index ngầm của ràng buộc UNIQUE được so ở mục "unique"
+                if not index.get("duplicates_constraint")
+            ),
+            "unique": sorted(sorted(constraint["column_names"]) for constraint in inspector.get_unique_constraints(table.name)),
+        }
+    return shapes
+
+def _fingerprint(shapes: dict[str, dict | None]) -> str:
+    return hashlib.sha256(json.dumps(shapes, sort_keys=True).encode()).hexdigest()
+
+def schema_fingerprint(engine: Engine) -> str:
+    """Băm cấu trúc mong đợi theo models (không truy vấn DB); so với giá trị đã lưu khi migrate."""
+    return _fingerprint(_model_shapes(engine.dialect.name))
+
+def _current_version(conn: Connection) -> tuple[int, str | None]:
+    row = conn.execute(
+        select(schema_version_table.c.version, schema_version_table.c.fingerprint)
+        .order_by(schema_version_table.c.id.desc())
+        .limit(1)
+    ).first()
+    return (row.version, row.fingerprint) if row else (0, None)
+
+def bootstrap_schema(engine: Engine) -> str:
+    """
+    Đảm bảo schema ở phiên bản mới nhất. Trường hợp thường gặp (đã cập nhật) chỉ tốn
+    một câu SELECT; migration chỉ chạy một lần, dưới khóa, dù có nhiều worker khởi động cùng lúc.
+    Trả về "up-to-date" hoặc "migrated".
+    """
+    fingerprint = schema_fingerprint(engine)
+    with engine.connect() as conn:
+        if inspect(conn).has_table(schema_version_table.name):
+            version, stored_fingerprint = _current_version(conn)
+        else:
+            version, stored_fingerprint = 0, None
+    if version >= SCHEMA_VERSION:
+        if stored_fingerprint != fingerprint:
+            print("WARNING: Database schema fingerprint differs from models; add a migration to app/schema.py.")
+        return "up-to-date"
+
+    # Chỉ một worker chạy migration, các worker khác chờ rồi thấy schema đã mới
+    with locks.exclusive(engine, _ADVISORY_LOCK_ID, "migrate"):
+        _prepare_enum_types(engine)
+        with engine.begin() as conn:
+            schema_meta.create_all(bind=conn, checkfirst=True)
+            # Kiểm tra lại sau khi có khóa: worker khác có thể đã migrate xong
+            version, _ = _current_version(conn)
+            if version >= SCHEMA_VERSION:
+                return "up-to-date"
+            for number, description, migrate in MIGRATIONS:
+                if number <= version:
+                    continue
+                print(f"Applying schema migration {number}: {description}...")
+                migrate(conn)
+            # Lưu dấu vân tay của schema THẬT sau khi migrate: nếu lệch models thì mọi lần khởi động sau đều cảnh báo
+            expected, live = _model_shapes(conn.dialect.name), _live_shapes(conn)
+            if live != expected:
+                drifted = sorted(name for name in expected if live.get(name) != expected[name])
+                print(f"ERROR: Database schema differs from models after migrating (tables: {', '.join(drifted)}); add a migration to app/schema.py.")
+            conn.execute(schema_version_table.insert().values(
+                version=SCHEMA_VERSION,
+                fingerprint=_fingerprint(live),
+                applied_at=datetime.now(timezone.utc),
+            ))
+    return "migrated"
@@ -1,7 +1,7 @@
 # app/schemas.py
 
 from __future__ import annotations
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 
 # Import Enum từ tệp models để dùng chung
@@ -21,4 +21,18 @@ class Key(KeyBase):
 
     # Cấu hình này cho phép Pydantic làm việc với các đối tượng SQLAlchemy
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+# Schema cho API tạo key hàng loạt
+class BulkMintRequest(BaseModel):
+    count: int = Field(..., ge=1, le=100_000)
+    days_valid: int | None = Field(None, ge=1)
+    status: KeyStatus = KeyStatus.unused
+
+class MintedKey(BaseModel):
+    id: int
+    key: str
+
+class BulkMintResult(BaseModel):
+    created: int
+    keys: list[MintedKey]
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from ..models import Activation, ActivationStatus, Device, LicenseKey, KeyStatus
 from ..auth import create_token
 from ..config import settings
+from . import presence
 
 HB_TIMEOUT = timedelta(seconds=settings.HEARTBEAT_TIMEOUT_SEC)
 
@@ -33,6 +34,14 @@ def bind_or_switch(db: Session, key: LicenseKey, dev: Device, client_version: st
     if key.status != KeyStatus.ACTIVE:
         raise ValueError("KEY_NOT_ACTIVE")
 
+    # Hỏi presence registry trong bộ nhớ trước; chỉ truy vấn SQL khi registry không biết key
+    entry = presence.registry.get(key.id)
+    if entry is not None and entry.machine_id != dev.fingerprint:
+        key.status = KeyStatus.TEMP_LOCKED
+        key.last_violation_at = datetime.utcnow()
+        db.commit()
+        raise ValueError("CONCURRENT_USE_DETECTED")
+
     online = current_online_activation(db, key.id)
     if online and online.device_id != dev.id:
         # concurrent usage -> temp lock
@@ -58,4 +67,5 @@ def bind_or_switch(db: Session, key: LicenseKey, dev: Device, client_version: st
     online.client_version = client_version
     online.client_build = build
     db.commit()
+    presence.touch(key.id, key.key, dev.fingerprint, online.last_seen_at)
     return online
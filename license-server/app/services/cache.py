@@ -0,0 +1,103 @@
+# app/services/cache.py
+
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+class TTLCache:
+    """
+    Cache trong bộ nhớ có giới hạn kích thước (LRU) và thời gian sống (TTL).
+    Đọc xuyên an toàn: lấy `generation` trước khi đọc nguồn, rồi ghi bằng set_if_current;
+    nếu key bị invalidate trong lúc đọc (ví dụ chờ DB) thì giá trị đã cũ không được ghi vào cache.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Bộ đếm invalidate và lần invalidate gần nhất của từng key (giới hạn max_size mục);
+        # mục bị đẩy ra hoặc clear() nâng _floor: mọi lần đọc bắt đầu trước mốc đó đều bị coi là cũ
+        self._generation = 0
+        self._invalidated: OrderedDict[Hashable, int] = OrderedDict()
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Trả về giá trị còn hạn, hoặc `default` nếu không có / đã hết hạn."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def set_if_current(self, key: Hashable, value: Any, generation: int) -> bool:
+        """Ghi như set(), trừ khi key đã bị invalidate sau thời điểm lấy `generation`. Trả về True nếu đã ghi."""
+        with self._lock:
+            if generation < self._floor or self._invalidated.get(key, -1) > generation:
+                return False
+            self._store(key, value)
+            return True
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_size:
+                _, evicted = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+            self._invalidated.clear()
+            self._floor = self._generation
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+def weak_etag(*parts) -> str:
+    """ETag yếu ghép từ các phần mà nội dung phụ thuộc vào (phiên bản bảng, ngày...)."""
+    return 'W/"' + "-".join(str(p) for p in parts) + '"'
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """So khớp header If-None-Match (có thể là danh sách hoặc '*') với `etag`."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in if_none_match.split(","))
@@ -0,0 +1,261 @@
+# app/services/events.py
+
+from __future__ import annotations
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, MetaData, String, Table, and_, inspect, insert, or_, select, text
+from sqlalchemy.orm import Session
+from ..config import settings
+
+# Loại sự kiện
+ACTIVATE = "activate"
+REVALIDATE = "revalidate"
+REJECTED = "rejected"
+MACHINE_SWITCH = "machine_switch"
+
+PARENT_TABLE = "activation_events"
+PARTITION_PREFIX = PARENT_TABLE + "_"
+# Số dòng mỗi câu INSERT nhiều dòng (8 cột, dưới giới hạn tham số của SQLite)
+INSERT_CHUNK = 500
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+@dataclass(frozen=True)
+class ActivationEvent:
+    occurred_at: datetime
+    kind: str
+    key_id: int | None
+    key: str | None
+    machine_id: str | None = None
+    client_ip: str | None = None
+    reason: str | None = None
+
+class EventQueue:
+    """Hàng đợi có giới hạn: khi đầy thì bỏ sự kiện mới (và đếm lại) thay vì làm chậm request."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: deque[ActivationEvent] = deque()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def put(self, event: ActivationEvent) -> bool:
+        with self._lock:
+            if len(self._items) >= self.max_size:
+                self.dropped += 1
+                return False
+            self._items.append(event)
+            return True
+
+    def drain(self) -> list[ActivationEvent]:
+        with self._lock:
+            items, self._items = list(self._items), deque()
+        return items
+
+    def restore(self, events: list[ActivationEvent]) -> None:
+        """Trả lại các sự kiện chưa ghi được lên đầu hàng đợi (trong giới hạn kích thước)."""
+        with self._lock:
+            room = max(0, self.max_size - len(self._items))
+            kept = events[-room:] if room else []
+            self.dropped += len(events) - len(kept)
+            self._items.extendleft(reversed(kept))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+event_queue = EventQueue(settings.EVENT_LOG_QUEUE_SIZE)
+
+def record(
+    kind: str,
+    key_id: int | None,
+    key: str | None,
+    machine_id: str | None = None,
+    client_ip: str | None = None,
+    reason: str | None = None,
+) -> None:
+    """Đưa một sự kiện vào hàng đợi trong bộ nhớ (không chạm DB); ghi xuống DB theo lô ở flush_events."""
+    event_queue.put(ActivationEvent(datetime.now(timezone.utc), kind, key_id, key, machine_id, client_ip, reason))
+
+def record_decision(decision, key_id: int | None, key: str, machine_id: str, client_ip: str | None = None) -> None:
+    """Ghi sự kiện tương ứng với một ActivationDecision (xem keys.decide_activation)."""
+    if not decision.ok:
+        kind = REJECTED
+    elif decision.action == "revalidate":
+        kind = REVALIDATE
+    elif decision.reason == "machine_switch":
+        kind = MACHINE_SWITCH
+    else:
+        kind = ACTIVATE
+    record(kind, key_id, key, machine_id, client_ip, decision.reason if kind == REJECTED else None)
+
+# --- Bảng phân vùng theo ngày (UTC): activation_events_YYYYMMDD ---
+# Postgres: phân vùng của bảng cha activation_events (PARTITION BY RANGE).
+# SQLite: các bảng độc lập cùng cấu trúc. Đọc/ghi dùng thẳng bảng con trên cả hai.
+
+_metadata = MetaData()
+_known_partitions: set[str] = set()
+_partitions_lock = threading.Lock()
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+def _partition_day(name: str) -> date | None:
+    suffix = name[len(PARTITION_PREFIX):]
+    if not name.startswith(PARTITION_PREFIX) or len(suffix) != 8 or not suffix.isdigit():
+        return None
+    return datetime.strptime(suffix, "%Y%m%d").date()
+
+def _partition_table(name: str) -> Table:
+    with _partitions_lock:
+        table = _metadata.tables.get(name)
+        if table is None:
+            table = Table(
+                name, _metadata,
+                Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True),
+                Column("occurred_at", DateTime(timezone=True), nullable=False),
+                Column("key_id", Integer, nullable=True),
+                Column("key", String, nullable=True),
+                Column("kind", String(20), nullable=False),
+                Column("reason", String(40), nullable=True),
+                Column("machine_id", String, nullable=True),
+                Column("client_ip", String(64), nullable=True),
+                Index(f"ix_{name}_key", "key_id", "occurred_at"),
+            )
+        return table
+
+def create_parent_table(conn) -> None:
+    """Tạo bảng cha phân vùng trên Postgres (gọi từ migration); SQLite không cần bảng cha."""
+    if conn.dialect.name != "postgresql":
+        return
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {PARENT_TABLE} ("
+        " id BIGSERIAL,"
+        " occurred_at TIMESTAMPTZ NOT NULL,"
+        " key_id INTEGER,"
+        " key VARCHAR,"
+        " kind VARCHAR(20) NOT NULL,"
+        " reason VARCHAR(40),"
+        " machine_id VARCHAR,"
+        " client_ip VARCHAR(64)"
+        ") PARTITION BY RANGE (occurred_at)"
+    ))
+
+def ensure_partition(db: Session, day: date) -> Table:
+    """Tạo phân vùng của ngày `day` nếu chưa có (chỉ chạy DDL lần đầu trong mỗi worker)."""
+    name = partition_name(day)
+    table = _partition_table(name)
+    if name in _known_partitions:
+        return table
+    if db.get_bind().dialect.name == "postgresql":
+        start = datetime.combine(day, datetime.min.time(), timezone.utc)
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{(start + timedelta(days=1)).isoformat()}')"
+        ))
+        db.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{name}_key ON {name} (key_id, occurred_at)"))
+    else:
+        table.create(db.connection(), checkfirst=True)
+    _known_partitions.add(name)
+    return table
+
+def list_partitions(db: Session) -> list[tuple[date, str]]:
+    """Các phân vùng hiện có, mới nhất trước (một truy vấn catalog)."""
+    found = []
+    for name in inspect(db.connection()).get_table_names():
+        day = _partition_day(name)
+        if day is not None:
+            found.append((day, name))
+    return sorted(found, reverse=True)
+
+def flush_events(db: Session) -> int:
+    """Ghi các sự kiện đang chờ bằng INSERT nhiều dòng, vào đúng phân vùng theo ngày. Trả về số sự kiện đã ghi."""
+    events = event_queue.drain()
+    if not events:
+        return 0
+    by_day: dict[date, list[dict]] = {}
+    for event in events:
+        by_day.setdefault(event.occurred_at.date(), []).append(asdict(event))
+    try:
+        for day, rows in sorted(by_day.items()):
+            table = ensure_partition(db, day)
+            for start in range(0, len(rows), INSERT_CHUNK):
+                db.execute(insert(table).values(rows[start:start + INSERT_CHUNK]))
+        db.commit()
+    except Exception:
+        db.rollback()
+        # DDL có thể đã bị rollback cùng transaction: lần sau kiểm tra lại
+        _known_partitions.clear()
+        event_queue.restore(events)
+        raise
+    return len(events)
+
+def maintain_partitions(db: Session) -> list[str]:
+    """
+    Tạo trước phân vùng của hôm nay và ngày mai, xóa các phân vùng quá EVENT_LOG_RETENTION_DAYS
+    bằng DROP TABLE (không quét DELETE). Trả về tên các phân vùng đã xóa.
+    """
+    today = datetime.now(timezone.utc).date()
+    oldest_kept = today - timedelta(days=settings.EVENT_LOG_RETENTION_DAYS)
+    dropped = []
+    try:
+        for day in (today, today + timedelta(days=1)):
+            ensure_partition(db, day)
+        for day, name in list_partitions(db):
+            if day < oldest_kept:
+                db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                _known_partitions.discard(name)
+                dropped.append(name)
+        db.commit()
+    except Exception:
+        db.rollback()
+        _known_partitions.clear()
+        raise
+    return dropped
+
+def _encode_cursor(row) -> str:
+    return f"{row['occurred_at'].isoformat()}_{row['id']}"
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    occurred_at, _, event_id = cursor.rpartition("_")
+    value = datetime.fromisoformat(occurred_at)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value, int(event_id)
+
+def key_history(
+    db: Session,
+    key_id: int,
+    before: str | None = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+) -> tuple[list[dict], str | None]:
+    """
+    Lịch sử sự kiện của một key, mới nhất trước, phân trang bằng con trỏ `before`.
+    Chỉ đọc các phân vùng từ ngày của con trỏ trở về trước, dừng ngay khi đủ một trang.
+    Trả về (danh sách sự kiện, con trỏ trang kế tiếp hoặc None).
+    """
+    cursor = _decode_cursor(before) if before else None
+    found: list[dict] = []
+    for day, name in list_partitions(db):
+        if cursor is not None and day > cursor[0].astimezone(timezone.utc).date():
+            continue
+        table = _partition_table(name)
+        query = select(table).where(table.c.key_id == key_id)
+        if cursor is not None:
+            query = query.where(or_(
+                table.c.occurred_at < cursor[0],
+                and_(table.c.occurred_at == cursor[0], table.c.id < cursor[1]),
+            ))
+        rows = db.execute(
+            query.order_by(table.c.occurred_at.desc(), table.c.id.desc()).limit(limit - len(found))
+        ).mappings().all()
+        for row in rows:
+            event = dict(row)
+            if event["occurred_at"].tzinfo is None:
+                event["occurred_at"] = event["occurred_at"].replace(tzinfo=timezone.utc)
+            found.append(event)
+        if len(found) >= limit:
+            return found, _encode_cursor(found[-1])
+    return found, None
@@ -0,0 +1,95 @@
+# app/services/heartbeats.py
+
+from __future__ import annotations
+import threading
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+from .. import models
+from ..config import settings
+from . import presence
+
+HEARTBEAT_TIMEOUT = timedelta(seconds=settings.HEARTBEAT_TIMEOUT_SEC)
+# Số dòng mỗi lần executemany khi xả buffer
+FLUSH_CHUNK = 1000
+
+class HeartbeatBuffer:
+    """
+    Buffer ghi sau (write-behind) cho heartbeat: chỉ giữ last_seen mới nhất của mỗi key
+    trong bộ nhớ và xả xuống DB theo lô, thay vì một câu UPDATE cho mỗi heartbeat.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: dict[int, datetime] = {}
+
+    def record(self, key_id: int, seen_at: datetime) -> None:
+        with self._lock:
+            current = self._pending.get(key_id)
+            if current is None or seen_at > current:
+                self._pending[key_id] = seen_at
+
+    def get(self, key_id: int) -> datetime | None:
+        with self._lock:
+            return self._pending.get(key_id)
+
+    def drain(self) -> dict[int, datetime]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, pending: dict[int, datetime]) -> None:
+        """Trả lại các mục chưa ghi được (giữ giá trị mới hơn nếu đã có heartbeat khác)."""
+        for key_id, seen_at in pending.items():
+            self.record(key_id, seen_at)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+heartbeat_buffer = HeartbeatBuffer()
+
+def record_heartbeat(key_id: int, seen_at: datetime | None = None) -> datetime:
+    """Ghi nhận heartbeat vào bộ nhớ (không chạm DB). Trả về thời điểm đã ghi nhận."""
+    seen_at = seen_at or datetime.now(timezone.utc)
+    heartbeat_buffer.record(key_id, seen_at)
+    return seen_at
+
+def flush_heartbeats(db: Session) -> int:
+    """Xả buffer xuống DB bằng các câu UPDATE theo lô (theo khóa chính). Trả về số key đã ghi."""
+    pending = heartbeat_buffer.drain()
+    if not pending:
+        return 0
+    rows = [{"b_id": key_id, "b_seen": seen_at} for key_id, seen_at in pending.items()]
+    table = models.Key.__table__
+    # UPDATE Core dạng executemany: key đã bị xóa trong lúc chờ chỉ đơn giản không khớp dòng nào
+    stmt = update(table).where(table.c.id == bindparam("b_id")).values(last_activated_at=bindparam("b_seen"))
+    try:
+        for start in range(0, len(rows), FLUSH_CHUNK):
+            db.execute(stmt, rows[start:start + FLUSH_CHUNK])
+        db.commit()
+    except Exception:
+        db.rollback()
+        heartbeat_buffer.restore(pending)
+        raise
+    return len(rows)
+
+def last_seen(db: Session, key_id: int) -> datetime | None:
+    """Thời điểm thấy key gần nhất: ưu tiên giá trị trong buffer, nếu không thì đọc DB."""
+    buffered = heartbeat_buffer.get(key_id)
+    if buffered is not None:
+        return buffered
+    value = db.query(models.Key.last_activated_at).filter(models.Key.id == key_id).scalar()
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def is_online(db: Session, key_id: int) -> bool:
+    """
+    Key được coi là online nếu có heartbeat trong HEARTBEAT_TIMEOUT_SEC gần nhất.
+    Hỏi presence registry trước, chỉ đọc DB khi registry chưa biết key (ví dụ vừa khởi động lại).
+    """
+    if presence.registry.is_online(key_id):
+        return True
+    seen = last_seen(db, key_id)
+    return seen is not None and datetime.now(timezone.utc) - seen <= HEARTBEAT_TIMEOUT
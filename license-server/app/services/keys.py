@@ -1,43 +1,239 @@
 # app/services/keys.py
 
 from __future__ import annotations
+from dataclasses import dataclass, replace
+from typing import Iterator
 from datetime import datetime, timezone, timedelta
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from .. import models
-import random
+from .. import bus, models
+from ..config import settings
+from .cache import TTLCache, weak_etag
+from . import heartbeats, license_tokens, presence, ratelimit, search, stats
+import secrets
 import string
 
+@dataclass(frozen=True)
+class CachedKey:
+    """Ảnh chụp (snapshot) của một key, an toàn để dùng chung giữa các session."""
+    id: int
+    key: str
+    status: models.KeyStatus
+    expiry_date: datetime | None
+    machine_id: str | None
+    username: str | None
+    last_activated_at: datetime | None
+    version: int
+
+    @classmethod
+    def from_model(cls, key: models.Key) -> "CachedKey":
+        return cls(
+            id=key.id,
+            key=key.key,
+            status=key.status,
+            expiry_date=_as_utc(key.expiry_date),
+            machine_id=key.machine_id,
+            username=key.username,
+            last_activated_at=_as_utc(key.last_activated_at),
+            version=key.version,
+        )
+
+# Cache đọc xuyên (read-through) cho luồng /activate, tra theo chuỗi key.
+# Key không tồn tại cũng được cache (giá trị _MISSING) để tránh truy vấn lặp lại.
+key_cache = TTLCache(max_size=settings.KEY_CACHE_MAX_SIZE, ttl_seconds=settings.KEY_CACHE_TTL_SEC)
+_MISSING = object()
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+
+MINT_BATCH_SIZE = 5000
+# Số tham số trong một câu IN (...) khi kiểm tra trùng, an toàn cho cả SQLite
+_IN_CHUNK = 900
+# Số mục tối đa trong một yêu cầu kích hoạt hàng loạt
+ACTIVATION_BATCH_MAX = 1000
+
+def table_etag(db: Session, *parts) -> str:
+    """
+    ETag cho các trang/API đọc bảng key, dựng từ phiên bản lưu trong key_stats
+    nên giống nhau ở mọi worker; `parts` thêm các yếu tố khác mà nội dung phụ thuộc vào.
+    """
+    return weak_etag(stats.data_version(db), *parts)
+
+def _invalidate(key_value: str) -> None:
+    """Xóa key khỏi cache sau mọi thao tác ghi."""
+    key_cache.invalidate(key_value)
+
+# --- Áp dụng thay đổi vào trạng thái trong bộ nhớ (cache, index, token, presence).
+# Cùng một hàm dùng cho thay đổi của chính worker này và cho sự kiện nhận từ worker khác qua bus.
+
+def _apply_changed(items: list) -> None:
+    """items: (id, key, version mới) của các key đã đổi trạng thái/máy/hạn."""
+    for key_id, key_value, version in items:
+        _invalidate(key_value)
+        license_tokens.revoke(key_id, version)
+
+def _apply_created(items: list) -> None:
+    """items: (id, key) của các key mới (xóa cả mục 'không tồn tại' đã cache)."""
+    for key_id, key_value in items:
+        _invalidate(key_value)
+        search.index_add(key_id, key_value)
+
+def _apply_deleted(items: list) -> None:
+    """items: (id, key) của các key đã xóa."""
+    for key_id, key_value in items:
+        _invalidate(key_value)
+        search.index_remove(key_id)
+        presence.registry.remove(key_id)
+        license_tokens.revoke_all(key_id)
+
+def _apply_resync(items: list) -> None:
+    # Có thể đã lỡ sự kiện: bỏ toàn bộ trạng thái dẫn xuất, nạp lại dần khi dùng
+    key_cache.clear()
+    search.key_index.clear()
+
+_KEY_EVENTS = {
+    "keys.changed": _apply_changed,
+    "keys.created": _apply_created,
+    "keys.deleted": _apply_deleted,
+    bus.RESYNC: _apply_resync,
+}
+for _event, _handler in _KEY_EVENTS.items():
+    bus.subscribe(_event, _handler)
+
+def _publish(event: str, items: list) -> None:
+    """Áp dụng thay đổi (sau commit) trong worker này rồi gửi cho các worker khác."""
+    if items:
+        _KEY_EVENTS[event](items)
+        bus.publish(event, [list(item) for item in items])
+
+def _update_keys(db: Session, where: list, values: dict) -> list[tuple[int, str, int]]:
+    """
+    UPDATE các key khớp điều kiện, tăng version (status version) trong cùng câu lệnh rồi commit.
+    key_stats được cập nhật trong cùng transaction; sau commit thì xóa cache
+    và thu hồi các license token đã cấp với version cũ.
+    Trả về (id, key, version mới) của các dòng đã thay đổi.
+    """
+    # Đọc trạng thái cũ (khóa dòng trên Postgres) để tính thay đổi của key_stats
+    before = {
+        row.id: row for row in db.execute(
+            select(models.Key.id, models.Key.status, models.Key.expiry_date).where(*where).with_for_update()
+        )
+    }
+    ids = list(before)
+    rows = []
+    delta = stats.StatsDelta()
+    for start in range(0, len(ids), _IN_CHUNK):
+        for row in db.execute(
+            update(models.Key)
+            .where(models.Key.id.in_(ids[start:start + _IN_CHUNK]), *where)
+            .values(**values, version=models.Key.version + 1)
+            .returning(models.Key.id, models.Key.key, models.Key.version, models.Key.status, models.Key.expiry_date)
+            .execution_options(synchronize_session=False)
+        ):
+            old = before[row.id]
+            delta.move(old.status, old.expiry_date, row.status, row.expiry_date)
+            rows.append((row.id, row.key, row.version))
+    stats.apply_delta(db, delta)
+    db.commit()
+    _publish("keys.changed", rows)
+    return rows
+
+_KEY_CHARS = string.ascii_uppercase + string.digits
+_KEY_LENGTH = 25
+# Ánh xạ mỗi byte ngẫu nhiên sang một ký tự; loại bỏ byte >= 252 để không bị lệch phân phối
+_BYTE_LIMIT = 256 - 256 % len(_KEY_CHARS)
+_BYTE_TABLE = bytes(ord(_KEY_CHARS[b % len(_KEY_CHARS)]) for b in range(256))
+_BYTE_REJECT = bytes(range(_BYTE_LIMIT, 256))
+
+def _format_key(chars: str) -> str:
+    return '-'.join(chars[i:i + 5] for i in range(0, _KEY_LENGTH, 5))
+
+def _generate_key_strings(count: int) -> list[str]:
+    """Tạo nhanh nhiều chuỗi key ngẫu nhiên từ một lần đọc secrets.token_bytes."""
+    needed = count * _KEY_LENGTH
+    pool = b""
+    while len(pool) < needed:
+        raw = secrets.token_bytes(needed - len(pool) + needed // 32 + 16)
+        pool += raw.translate(_BYTE_TABLE, _BYTE_REJECT)
+    text = pool[:needed].decode("ascii")
+    return [_format_key(text[i:i + _KEY_LENGTH]) for i in range(0, needed, _KEY_LENGTH)]
+
 def _generate_key_string() -> str:
-    """Hàm nội bộ để tạo chuỗi key ngẫu nhiên."""
-    chars = string.ascii_uppercase + string.digits
-    return '-'.join(''.join(random.choice(chars) for _ in range(5)) for _ in range(5))
+    """Hàm nội bộ để tạo chuỗi key ngẫu nhiên (dùng secrets, an toàn về mật mã)."""
+    return _generate_key_strings(1)[0]
+
+def _as_utc(value: datetime | None) -> datetime | None:
+    """Chuẩn hóa datetime về UTC (SQLite trả về datetime không có tzinfo)."""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
 
-def check_and_update_all_keys_status(db: Session):
-    """Kiểm tra và cập nhật trạng thái của tất cả các key đã hết hạn."""
+def expire_overdue_keys(db: Session) -> int:
+    """
+    Đánh dấu 'expired' cho mọi key đã quá hạn bằng một câu UPDATE duy nhất
+    (dùng index expiry_date/status). Trả về số dòng đã thay đổi.
+    """
     now = datetime.now(timezone.utc)
-    keys_to_check = db.query(models.Key).filter(models.Key.status != 'expired').all()
-    needs_commit = False
-    for key in keys_to_check:
-        if key.expiry_date and key.expiry_date < now:
-            key.status = 'expired'
-            needs_commit = True
-    if needs_commit:
-        db.commit()
+    rows = _update_keys(
+        db,
+        [models.Key.expiry_date < now, models.Key.status != models.KeyStatus.expired],
+        {"status": models.KeyStatus.expired},
+    )
+    return len(rows)
+
+def _expire_if_overdue(db: Session, record: CachedKey) -> CachedKey:
+    """Hết hạn lười (lazy) cho một key khi đọc, không chờ bộ quét định kỳ."""
+    expiry = _as_utc(record.expiry_date)
+    if record.status == models.KeyStatus.expired or not expiry or expiry >= datetime.now(timezone.utc):
+        return record
+    rows = _update_keys(
+        db,
+        [models.Key.id == record.id, models.Key.status != models.KeyStatus.expired],
+        {"status": models.KeyStatus.expired},
+    )
+    version = rows[0][2] if rows else record.version
+    record = replace(record, status=models.KeyStatus.expired, version=version)
+    key_cache.set(record.key, record)
+    return record
 
 def get_all_keys(db: Session) -> list[models.Key]:
-    """Lấy tất cả các key, luôn kiểm tra trạng thái trước."""
-    check_and_update_all_keys_status(db)
+    """Lấy tất cả các key (chỉ đọc, việc hết hạn do bộ quét đảm nhiệm)."""
     return db.query(models.Key).order_by(models.Key.id.desc()).all()
 
+def list_keys_page(db: Session, limit: int = DEFAULT_PAGE_SIZE, after_id: int | None = None) -> list[models.Key]:
+    """
+    Phân trang keyset theo id giảm dần: trả về tối đa `limit` key có id < `after_id`.
+    Trang tiếp theo dùng id của key cuối cùng làm `after_id`.
+    """
+    query = db.query(models.Key)
+    if after_id is not None:
+        query = query.filter(models.Key.id < after_id)
+    return query.order_by(models.Key.id.desc()).limit(limit).all()
+
+def iter_all_keys(db: Session, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[models.Key]:
+    """Duyệt toàn bộ key theo từng lô phía server (yield_per) để bộ nhớ không tăng theo kích thước bảng."""
+    stmt = (
+        select(models.Key)
+        .order_by(models.Key.id.desc())
+        .execution_options(yield_per=batch_size)
+    )
+    yield from db.execute(stmt).scalars()
+
 def activate_key_by_id(db: Session, key_id: int) -> models.Key | None:
     """Kích hoạt một key cụ thể."""
     key = db.query(models.Key).filter(models.Key.id == key_id).first()
     if key and key.status == 'unused':
+        old_status, old_expiry = key.status, key.expiry_date
         key.status = 'active'
         if not key.expiry_date:
             key.expiry_date = datetime.now(timezone.utc) + timedelta(days=30)
+        key.version = models.Key.version + 1
+        stats.apply_delta(db, stats.StatsDelta().move(old_status, old_expiry, key.status, key.expiry_date))
         db.commit()
         db.refresh(key)
+        _publish("keys.changed", [(key.id, key.key, key.version)])
         return key
     return None
 
@@ -51,15 +247,308 @@ def create_new_key(db: Session, days_valid: int | None = None) -> models.Key:
         new_key_data.expiry_date = datetime.now(timezone.utc) + timedelta(days=days_valid)
     
     db.add(new_key_data)
+    stats.apply_delta(db, stats.StatsDelta().add(new_key_data.status, new_key_data.expiry_date))
     db.commit()
     db.refresh(new_key_data)
+    _publish("keys.created", [(new_key_data.id, new_key_data.key)])
     return new_key_data
 
+def _existing_key_values(db: Session, candidates: list[str]) -> set[str]:
+    """Trả về các chuỗi key trong `candidates` đã có trong DB."""
+    existing: set[str] = set()
+    for start in range(0, len(candidates), _IN_CHUNK):
+        chunk = candidates[start:start + _IN_CHUNK]
+        existing.update(db.execute(select(models.Key.key).where(models.Key.key.in_(chunk))).scalars())
+    return existing
+
+def _insert_ignoring_duplicates(db: Session, rows: list[dict]) -> list[tuple[int, str]]:
+    """
+    Chèn nhiều dòng trong một lệnh (executemany / insertmanyvalues) và trả về (id, key) đã tạo.
+    Dòng trùng key (do ghi đồng thời) bị bỏ qua thay vì làm hỏng cả lô.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        stmt = postgresql.insert(models.Key).on_conflict_do_nothing(index_elements=["key"])
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(models.Key).on_conflict_do_nothing(index_elements=["key"])
+    else:
+        stmt = insert(models.Key)
+    result = db.execute(stmt.returning(models.Key.id, models.Key.key), rows)
+    return [(row.id, row.key) for row in result]
+
+def iter_mint_keys(
+    db: Session,
+    count: int,
+    days_valid: int | None = None,
+    status: models.KeyStatus = models.KeyStatus.unused,
+    batch_size: int = MINT_BATCH_SIZE,
+) -> Iterator[list[tuple[int, str]]]:
+    """
+    Tạo hàng loạt key, commit và trả về theo từng lô (id, key).
+    Trùng lặp được loại bỏ trong bộ nhớ trước khi chèn; chỉ các key bị trùng mới được sinh lại.
+    """
+    expiry_date = None
+    if days_valid and days_valid > 0:
+        expiry_date = datetime.now(timezone.utc) + timedelta(days=days_valid)
+    elif status == models.KeyStatus.active:
+        # Giống activate_key_by_id: key kích hoạt sẵn mặc định có hạn 30 ngày
+        expiry_date = datetime.now(timezone.utc) + timedelta(days=30)
+
+    remaining = count
+    while remaining > 0:
+        wanted = min(remaining, batch_size)
+        candidates: set[str] = set()
+        while len(candidates) < wanted:
+            candidates.update(_generate_key_strings(wanted - len(candidates)))
+        fresh = list(candidates - _existing_key_values(db, list(candidates)))
+        if not fresh:
+            continue
+        rows = [{"key": value, "status": status, "expiry_date": expiry_date} for value in fresh]
+        created = _insert_ignoring_duplicates(db, rows)
+        stats.apply_delta(db, stats.StatsDelta().add(status, expiry_date, len(created)))
+        db.commit()
+        _publish("keys.created", created)
+        remaining -= len(created)
+        yield created
+
+def mint_keys(
+    db: Session,
+    count: int,
+    days_valid: int | None = None,
+    status: models.KeyStatus = models.KeyStatus.unused,
+) -> list[tuple[int, str]]:
+    """Tạo `count` key mới theo lô và trả về toàn bộ (id, key) đã tạo."""
+    created: list[tuple[int, str]] = []
+    for batch in iter_mint_keys(db, count, days_valid=days_valid, status=status):
+        created.extend(batch)
+    return created
+
 def delete_key_by_id(db: Session, key_id: int) -> bool:
     """Xóa một key khỏi database."""
     key_to_delete = db.query(models.Key).filter(models.Key.id == key_id).first()
     if key_to_delete:
+        key_value = key_to_delete.key
         db.delete(key_to_delete)
+        stats.apply_delta(db, stats.StatsDelta().remove(key_to_delete.status, key_to_delete.expiry_date))
         db.commit()
+        _publish("keys.deleted", [(key_id, key_value)])
         return True
-    return False
\ No newline at end of file
+    return False
+
+def get_key_by_value(db: Session, key_value: str) -> CachedKey | None:
+    """Tìm key theo chuỗi, ưu tiên đọc từ cache."""
+    cached = key_cache.get(key_value)
+    if cached is not None:
+        return None if cached is _MISSING else _expire_if_overdue(db, cached)
+    # Lấy generation trước khi truy vấn: trong lúc chờ DB, một thao tác xóa/đổi trạng thái có thể đã
+    # commit và invalidate key; khi đó không ghi bản đọc cũ vào cache
+    generation = key_cache.generation
+    key = db.query(models.Key).filter(models.Key.key == key_value).first()
+    record = CachedKey.from_model(key) if key else None
+    key_cache.set_if_current(key_value, record if record else _MISSING, generation)
+    return _expire_if_overdue(db, record) if record else None
+
+def update_key_status(db: Session, key_value: str, status: str) -> None:
+    """Cập nhật trạng thái của một key."""
+    _update_keys(db, [models.Key.key == key_value], {"status": status})
+
+def increment_failed_attempts(db: Session, key_value: str) -> None:
+    """Tăng bộ đếm số lần kích hoạt thất bại (cộng dồn trong bộ nhớ, xả xuống DB theo lô)."""
+    record = get_key_by_value(db, key_value)
+    if record is not None:
+        ratelimit.failed_attempts.add(record.id)
+
+def update_last_activated_time(db: Session, key_value: str) -> None:
+    """
+    Ghi nhận thời điểm xác thực lại qua buffer heartbeat (ghi sau, theo lô)
+    để lượt xác thực lại không phải chạm DB.
+    """
+    generation = key_cache.generation
+    record = get_key_by_value(db, key_value)
+    if record is None:
+        return
+    seen_at = heartbeats.record_heartbeat(record.id)
+    presence.touch(record.id, record.key, record.machine_id, seen_at)
+    # Ghi xuyên (write-through) để lượt tiếp theo vẫn trúng cache
+    key_cache.set_if_current(key_value, replace(record, last_activated_at=seen_at), generation)
+
+def set_activation_details(db: Session, key_value: str, machine_id: str, username: str) -> bool:
+    """
+    Gắn key với máy tính của người dùng và chuyển sang trạng thái 'used'.
+    Chỉ ghi khi key vẫn đang 'active': trong các yêu cầu kích hoạt đồng thời chỉ một yêu cầu thắng.
+    Trả về False nếu key đã bị yêu cầu khác thay đổi trước đó.
+    """
+    now = datetime.now(timezone.utc)
+    changed = _update_keys(db, [models.Key.key == key_value, models.Key.status == models.KeyStatus.active], {
+        "status": models.KeyStatus.used,
+        "machine_id": machine_id,
+        "username": username,
+        "last_activated_at": now,
+    })
+    if not changed:
+        # Cache có thể còn giữ trạng thái 'active' đã cũ
+        _invalidate(key_value)
+        return False
+    # Nạp lại cache ngay (lần xác thực lại tiếp theo sẽ trúng cache) và đánh dấu máy online
+    record = get_key_by_value(db, key_value)
+    if record is not None:
+        presence.touch(record.id, record.key, machine_id, now)
+    return True
+
+# --- Máy trạng thái kích hoạt, dùng chung cho /activate và /activate/batch ---
+
+@dataclass(frozen=True)
+class ActivationDecision:
+    """Kết quả xét một yêu cầu kích hoạt: mã HTTP, thông báo và thao tác ghi cần làm (nếu có)."""
+    http_status: int
+    message: str
+    # "activate" | "revalidate" | "expire" | "fail" | None
+    action: str | None = None
+    # Mã lý do ghi vào nhật ký sự kiện. Từ chối: not_found, expired, revoked, other_machine, bad_status, conflict;
+    # thành công: machine_switch khi key được kích hoạt lại trên máy khác với máy đã gắn trước đó
+    reason: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.http_status == 200
+
+# Key vừa bị một yêu cầu khác thay đổi giữa lúc đọc và lúc ghi
+CONFLICT_DECISION = ActivationDecision(409, "Trạng thái key vừa thay đổi, vui lòng thử lại.", reason="conflict")
+
+def _expired_message(record: CachedKey) -> str:
+    if record.expiry_date is None:
+        return "Key này đã hết hạn."
+    return f"Key này đã hết hạn vào lúc {record.expiry_date.strftime('%H:%M %d-%m-%Y')}."
+
+def decide_activation(record: CachedKey | None, machine_id: str, now: datetime | None = None) -> ActivationDecision:
+    """Áp dụng quy tắc kích hoạt cho một key (hàm thuần, không chạm DB)."""
+    now = now or datetime.now(timezone.utc)
+    if record is None:
+        return ActivationDecision(404, "Key không hợp lệ hoặc không tồn tại.", reason="not_found")
+    if record.expiry_date and record.expiry_date < now:
+        action = "expire" if record.status != models.KeyStatus.expired else None
+        return ActivationDecision(403, _expired_message(record), action, "expired")
+    if record.status == models.KeyStatus.revoked:
+        return ActivationDecision(403, "Key này đã bị quản trị viên tạm khóa.", "fail", "revoked")
+    if record.status == models.KeyStatus.used:
+        if record.machine_id == machine_id:
+            return ActivationDecision(200, "Key đã được xác thực lại trên máy này.", "revalidate")
+        return ActivationDecision(403, "Key này đã được sử dụng trên một máy tính khác.", "fail", "other_machine")
+    if record.status == models.KeyStatus.expired:
+        return ActivationDecision(403, _expired_message(record), reason="expired")
+    if record.status == models.KeyStatus.active:
+        switched = record.machine_id is not None and record.machine_id != machine_id
+        return ActivationDecision(200, "Kích hoạt thành công!", "activate", "machine_switch" if switched else None)
+    return ActivationDecision(400, f"Không thể kích hoạt key với trạng thái '{record.status.value}'.", reason="bad_status")
+
+def _load_keys_by_value(db: Session, key_values: list[str]) -> dict[str, CachedKey]:
+    """Đọc nhiều key từ DB bằng câu IN (chia khúc _IN_CHUNK) và làm mới cache."""
+    found: dict[str, CachedKey] = {}
+    for start in range(0, len(key_values), _IN_CHUNK):
+        chunk = key_values[start:start + _IN_CHUNK]
+        for key in db.execute(select(models.Key).where(models.Key.key.in_(chunk))).scalars():
+            found[key.key] = CachedKey.from_model(key)
+    return found
+
+def activate_keys_batch(
+    db: Session,
+    entries: list[tuple[str, str, str]],
+) -> list[tuple[ActivationDecision, CachedKey | None]]:
+    """
+    Kích hoạt hàng loạt các mục (key, machine_id, username) theo đúng quy tắc của /activate.
+    Mọi key được đọc bằng truy vấn IN, mọi thay đổi trạng thái được ghi trong một transaction.
+    Trả về (quyết định, bản ghi key sau khi xử lý) theo đúng thứ tự đầu vào.
+    """
+    now = datetime.now(timezone.utc)
+    generation = key_cache.generation
+    state = _load_keys_by_value(db, list(dict.fromkeys(key_value for key_value, _, _ in entries)))
+
+    results: list[tuple[ActivationDecision, CachedKey | None]] = []
+    to_expire: dict[int, CachedKey] = {}
+    to_activate: dict[int, tuple[str, str]] = {}
+    for key_value, machine_id, username in entries:
+        record = state.get(key_value)
+        decision = decide_activation(record, machine_id, now)
+        if decision.action == "expire":
+            to_expire[record.id] = record
+            record = state[key_value] = replace(record, status=models.KeyStatus.expired)
+        elif decision.action == "activate":
+            to_activate[record.id] = (machine_id, username)
+            # Các mục sau trong cùng lô thấy key đã gắn với máy này
+            record = state[key_value] = replace(
+                record, status=models.KeyStatus.used, machine_id=machine_id,
+                username=username, last_activated_at=now,
+            )
+        results.append((decision, record))
+
+    changed: dict[int, int] = {}
+    delta = stats.StatsDelta()
+    table = models.Key.__table__
+    expire_ids = list(to_expire)
+    for start in range(0, len(expire_ids), _IN_CHUNK):
+        chunk = expire_ids[start:start + _IN_CHUNK]
+        for key_id, version in db.execute(
+            update(table)
+            .where(table.c.id.in_(chunk), table.c.status != models.KeyStatus.expired)
+            .values(status=models.KeyStatus.expired, version=table.c.version + 1)
+            .returning(table.c.id, table.c.version)
+        ):
+            old = to_expire[key_id]
+            delta.move(old.status, old.expiry_date, models.KeyStatus.expired, old.expiry_date)
+            changed[key_id] = version
+    activate_ids = list(to_activate)
+    for start in range(0, len(activate_ids), _IN_CHUNK):
+        chunk = activate_ids[start:start + _IN_CHUNK]
+        # Một câu UPDATE cho cả khúc: giá trị riêng của từng dòng chọn bằng CASE theo id
+        activated = db.execute(
+            update(table)
+            .where(table.c.id.in_(chunk), table.c.status == models.KeyStatus.active)
+            .values(
+                status=models.KeyStatus.used,
+                machine_id=case({i: to_activate[i][0] for i in chunk}, value=table.c.id),
+                username=case({i: to_activate[i][1] for i in chunk}, value=table.c.id),
+                last_activated_at=now,
+                version=table.c.version + 1,
+            )
+            .returning(table.c.id, table.c.version, table.c.expiry_date)
+        ).all()
+        for key_id, version, expiry_date in activated:
+            delta.move(models.KeyStatus.active, expiry_date, models.KeyStatus.used, expiry_date)
+            changed[key_id] = version
+    stats.apply_delta(db, delta)
+    db.commit()
+    key_values = {record.id: record.key for record in state.values()}
+    _publish("keys.changed", [(key_id, key_values[key_id], version) for key_id, version in changed.items()])
+
+    lost = {key_id for key_id in to_activate if key_id not in changed}
+    for key_value in {key_value for key_value, _, _ in entries}:
+        record = state.get(key_value)
+        if record is None:
+            # Không cache key không tồn tại từ lô: một lô dò key ngẫu nhiên sẽ đẩy các key thật ra khỏi cache
+            continue
+        if record.id in lost:
+            _invalidate(key_value)
+        elif record.id in changed:
+            # Token cấp cho key vừa ghi phải mang version mới
+            state[key_value] = replace(record, version=changed[record.id])
+        else:
+            # Nạp sẵn cache bằng dữ liệu vừa đọc (key chỉ được xác thực lại): lượt sau không cần truy vấn.
+            # Key vừa được ghi đã bị _publish invalidate; nạp lại khi đọc để không ghi đè thay đổi đồng thời.
+            key_cache.set_if_current(key_value, record, generation)
+
+    output: list[tuple[ActivationDecision, CachedKey | None]] = []
+    for (key_value, machine_id, _), (decision, record) in zip(entries, results):
+        if record is not None and record.id in lost and decision.action == "activate":
+            output.append((CONFLICT_DECISION, None))
+            continue
+        if decision.action == "fail":
+            ratelimit.failed_attempts.add(record.id)
+        elif decision.action == "revalidate":
+            seen_at = heartbeats.record_heartbeat(record.id, now)
+            presence.touch(record.id, record.key, machine_id, seen_at)
+        elif decision.action == "activate":
+            presence.touch(record.id, record.key, machine_id, now)
+        if record is not None:
+            record = replace(record, version=state[key_value].version)
+        output.append((decision, record))
+    return output
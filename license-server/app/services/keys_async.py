@@ -0,0 +1,83 @@
+# app/services/keys_async.py
+
+"""
+Phiên bản async của services/keys.py cho các route `async def`.
+Mỗi hàm chạy đúng logic đồng bộ qua AsyncSession.run_sync: I/O đi qua driver async
+(asyncpg / aiosqlite) nên event loop không bị chặn, và không phải nhân đôi logic nghiệp vụ.
+"""
+
+from __future__ import annotations
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+from . import events, keys, search, stats
+from .keys import CachedKey
+
+async def get_all_keys(db: AsyncSession) -> list[models.Key]:
+    return await db.run_sync(keys.get_all_keys)
+
+async def list_keys_page(db: AsyncSession, limit: int = keys.DEFAULT_PAGE_SIZE, after_id: int | None = None) -> list[models.Key]:
+    return await db.run_sync(keys.list_keys_page, limit, after_id)
+
+async def expire_overdue_keys(db: AsyncSession) -> int:
+    return await db.run_sync(keys.expire_overdue_keys)
+
+async def activate_key_by_id(db: AsyncSession, key_id: int) -> models.Key | None:
+    return await db.run_sync(keys.activate_key_by_id, key_id)
+
+async def create_new_key(db: AsyncSession, days_valid: int | None = None) -> models.Key:
+    return await db.run_sync(keys.create_new_key, days_valid)
+
+async def mint_keys(
+    db: AsyncSession,
+    count: int,
+    days_valid: int | None = None,
+    status: models.KeyStatus = models.KeyStatus.unused,
+) -> list[tuple[int, str]]:
+    return await db.run_sync(keys.mint_keys, count, days_valid, status)
+
+async def delete_key_by_id(db: AsyncSession, key_id: int) -> bool:
+    return await db.run_sync(keys.delete_key_by_id, key_id)
+
+async def get_key_by_value(db: AsyncSession, key_value: str) -> CachedKey | None:
+    return await db.run_sync(keys.get_key_by_value, key_value)
+
+async def update_key_status(db: AsyncSession, key_value: str, status: str) -> None:
+    await db.run_sync(keys.update_key_status, key_value, status)
+
+async def increment_failed_attempts(db: AsyncSession, key_value: str) -> None:
+    await db.run_sync(keys.increment_failed_attempts, key_value)
+
+async def update_last_activated_time(db: AsyncSession, key_value: str) -> None:
+    await db.run_sync(keys.update_last_activated_time, key_value)
+
+async def set_activation_details(db: AsyncSession, key_value: str, machine_id: str, username: str) -> bool:
+    return await db.run_sync(keys.set_activation_details, key_value, machine_id, username)
+
+async def activate_keys_batch(
+    db: AsyncSession,
+    entries: list[tuple[str, str, str]],
+) -> list[tuple[keys.ActivationDecision, CachedKey | None]]:
+    return await db.run_sync(keys.activate_keys_batch, entries)
+
+async def search_keys(
+    db: AsyncSession,
+    term: str,
+    status: models.KeyStatus | None = None,
+    prefix: bool = False,
+    limit: int = search.DEFAULT_LIMIT,
+) -> list[models.Key]:
+    return await db.run_sync(search.search_keys, term, status, prefix, limit)
+
+async def table_etag(db: AsyncSession, *parts) -> str:
+    return await db.run_sync(keys.table_etag, *parts)
+
+async def stats_summary(db: AsyncSession) -> dict:
+    return await db.run_sync(stats.summary)
+
+async def key_history(
+    db: AsyncSession,
+    key_id: int,
+    before: str | None = None,
+    limit: int = events.DEFAULT_PAGE_SIZE,
+) -> tuple[list[dict], str | None]:
+    return await db.run_sync(events.key_history, key_id, before, limit)
@@ -0,0 +1,134 @@
+# app/services/license_tokens.py
+
+from __future__ import annotations
+import sys
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from jose import ExpiredSignatureError, JWTError, jwk
+from ..auth import create_signed_token, decode_signed_token
+from ..config import settings
+
+TOKEN_TYPE = "license"
+SUPPORTED_ALGORITHMS = ("ES256", "RS256")
+TOKEN_ALGORITHM = settings.LICENSE_TOKEN_ALGORITHM
+TOKEN_TTL = timedelta(minutes=settings.LICENSE_TOKEN_TTL_MIN)
+OFFLINE_GRACE = timedelta(seconds=settings.LICENSE_TOKEN_OFFLINE_GRACE_SEC)
+# Dùng khi key bị xóa: mọi version đều bị thu hồi
+_ALL_VERSIONS = sys.maxsize
+
+class TokenError(Exception):
+    """Token không hợp lệ; `reason` là mã lỗi ngắn trả về cho client."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+def _load_keys() -> tuple[str | None, str | None]:
+    """Đọc khóa bí mật từ settings và suy ra khóa công khai. Trả về (None, None) nếu chưa cấu hình."""
+    if TOKEN_ALGORITHM not in SUPPORTED_ALGORITHMS:
+        raise ValueError(f"LICENSE_TOKEN_ALGORITHM must be one of {', '.join(SUPPORTED_ALGORITHMS)}.")
+    private_pem = settings.LICENSE_TOKEN_PRIVATE_KEY
+    if not private_pem and settings.LICENSE_TOKEN_PRIVATE_KEY_FILE:
+        with open(settings.LICENSE_TOKEN_PRIVATE_KEY_FILE, encoding="utf-8") as f:
+            private_pem = f.read()
+    if not private_pem:
+        return None, None
+    # Biến môi trường thường chứa PEM trên một dòng với "\n"
+    private_pem = private_pem.replace("\\n", "\n")
+    public_pem = jwk.construct(private_pem, TOKEN_ALGORITHM).public_key().to_pem()
+    return private_pem, public_pem.decode() if isinstance(public_pem, bytes) else public_pem
+
+PRIVATE_KEY, PUBLIC_KEY = _load_keys()
+
+def signing_enabled() -> bool:
+    return PRIVATE_KEY is not None
+
+class RevocationSet:
+    """
+    Danh sách thu hồi trong bộ nhớ: key_id -> version nhỏ nhất còn hợp lệ.
+    Mỗi mục chỉ cần giữ trong một TTL token, sau đó mọi token cũ đã tự hết hạn,
+    nên kích thước tỉ lệ với số thay đổi trong một TTL chứ không với số key.
+    """
+
+    def __init__(self, retention_sec: float):
+        self.retention_sec = retention_sec
+        self._lock = threading.Lock()
+        self._entries: dict[int, tuple[int, float]] = {}
+
+    def revoke(self, key_id: int, min_version: int) -> None:
+        with self._lock:
+            current = self._entries.get(key_id)
+            if current is None or min_version >= current[0]:
+                self._entries[key_id] = (min_version, time.monotonic() + self.retention_sec)
+
+    def is_revoked(self, key_id: int, version: int) -> bool:
+        with self._lock:
+            entry = self._entries.get(key_id)
+            if entry is None:
+                return False
+            if entry[1] < time.monotonic():
+                del self._entries[key_id]
+                return False
+            return version < entry[0]
+
+    def prune(self) -> int:
+        """Bỏ các mục đã quá hạn giữ lại. Trả về số mục đã bỏ."""
+        now = time.monotonic()
+        with self._lock:
+            stale = [key_id for key_id, (_, until) in self._entries.items() if until < now]
+            for key_id in stale:
+                del self._entries[key_id]
+        return len(stale)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+revocations = RevocationSet(retention_sec=TOKEN_TTL.total_seconds() + 60)
+
+def revoke(key_id: int, current_version: int) -> None:
+    """Vô hiệu hóa các token mang version cũ hơn `current_version`."""
+    revocations.revoke(key_id, current_version)
+
+def revoke_all(key_id: int) -> None:
+    """Vô hiệu hóa mọi token của key (ví dụ khi key bị xóa)."""
+    revocations.revoke(key_id, _ALL_VERSIONS)
+
+def issue_token(key_record, machine_id: str) -> tuple[str, datetime]:
+    """Cấp license token cho một key vừa xác thực thành công. Trả về (token, thời điểm hết hạn)."""
+    if PRIVATE_KEY is None:
+        # Không bao giờ ký bằng khóa mặc định/đoán được
+        raise TokenError("signing_disabled")
+    expires_at = datetime.now(timezone.utc) + TOKEN_TTL
+    key_expiry = key_record.expiry_date
+    if key_expiry is not None:
+        if key_expiry.tzinfo is None:
+            key_expiry = key_expiry.replace(tzinfo=timezone.utc)
+        expires_at = min(expires_at, key_expiry)
+    claims = {
+        "typ": TOKEN_TYPE,
+        "kid": key_record.id,
+        "mid": machine_id,
+        "sv": key_record.version,
+        "st": key_record.status.value,
+    }
+    return create_signed_token(claims, expires_at, secret=PRIVATE_KEY, algorithm=TOKEN_ALGORITHM), expires_at
+
+def verify_token(token: str, machine_id: str | None = None) -> dict:
+    """Kiểm tra chữ ký, hạn, máy và danh sách thu hồi, không truy vấn DB. Trả về claim."""
+    if PUBLIC_KEY is None:
+        raise TokenError("signing_disabled")
+    try:
+        claims = decode_signed_token(token, secret=PUBLIC_KEY, algorithm=TOKEN_ALGORITHM)
+    except ExpiredSignatureError:
+        raise TokenError("expired")
+    except JWTError:
+        raise TokenError("invalid_signature")
+    if claims.get("typ") != TOKEN_TYPE:
+        raise TokenError("invalid_type")
+    if machine_id is not None and claims.get("mid") != machine_id:
+        raise TokenError("machine_mismatch")
+    if revocations.is_revoked(claims["kid"], claims["sv"]):
+        raise TokenError("revoked")
+    return claims
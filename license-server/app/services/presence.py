@@ -0,0 +1,138 @@
+# app/services/presence.py
+
+from __future__ import annotations
+import asyncio
+import math
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from .. import bus
+from ..config import settings
+
+@dataclass
+class PresenceEntry:
+    key_id: int
+    key: str
+    machine_id: str | None
+    last_seen: datetime
+    slot: int
+
+class PresenceRegistry:
+    """
+    Danh sách thiết bị online trong bộ nhớ, hết hạn bằng hashed timing wheel:
+    mỗi lần touch chỉ chuyển key sang ô (slot) tương ứng với thời điểm hết hạn,
+    mỗi tick chỉ xét đúng một ô, nên thiết bị offline được phát hiện mà không cần quét.
+    """
+
+    def __init__(self, timeout_sec: int, tick_sec: float = 1.0):
+        self.tick_sec = tick_sec
+        self.timeout_ticks = max(1, math.ceil(timeout_sec / tick_sec))
+        # Vòng lớn hơn timeout để mọi mục trong ô hiện tại đều thực sự đã hết hạn
+        self._wheel: list[set[int]] = [set() for _ in range(self.timeout_ticks + 1)]
+        self._cursor = 0
+        self._entries: dict[int, PresenceEntry] = {}
+        self._lock = threading.Lock()
+        self._subscribers: set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = set()
+
+    def touch(self, key_id: int, key: str, machine_id: str | None, seen_at: datetime | None = None) -> None:
+        """Ghi nhận key đang online; O(1)."""
+        seen_at = seen_at or datetime.now(timezone.utc)
+        with self._lock:
+            slot = (self._cursor + self.timeout_ticks) % len(self._wheel)
+            entry = self._entries.get(key_id)
+            came_online = entry is None
+            if entry is None:
+                entry = PresenceEntry(key_id, key, machine_id, seen_at, slot)
+                self._entries[key_id] = entry
+            else:
+                self._wheel[entry.slot].discard(key_id)
+                entry.machine_id, entry.last_seen, entry.slot = machine_id, seen_at, slot
+            self._wheel[slot].add(key_id)
+        if came_online:
+            self._publish("online", entry)
+
+    def remove(self, key_id: int) -> None:
+        """Xóa key khỏi danh sách online (ví dụ khi key bị xóa hoặc thu hồi)."""
+        with self._lock:
+            entry = self._entries.pop(key_id, None)
+            if entry is not None:
+                self._wheel[entry.slot].discard(key_id)
+        if entry is not None:
+            self._publish("offline", entry)
+
+    def tick(self) -> list[PresenceEntry]:
+        """Tiến vòng thêm một ô và trả về các key vừa chuyển offline."""
+        with self._lock:
+            self._cursor = (self._cursor + 1) % len(self._wheel)
+            expired_ids = self._wheel[self._cursor]
+            self._wheel[self._cursor] = set()
+            expired = [self._entries.pop(key_id) for key_id in expired_ids]
+        for entry in expired:
+            self._publish("offline", entry)
+        return expired
+
+    def get(self, key_id: int) -> PresenceEntry | None:
+        with self._lock:
+            return self._entries.get(key_id)
+
+    def is_online(self, key_id: int) -> bool:
+        with self._lock:
+            return key_id in self._entries
+
+    def snapshot(self) -> list[PresenceEntry]:
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda e: e.last_seen, reverse=True)
+
+    # --- Đẩy thay đổi (online/offline) cho các trang giám sát qua SSE ---
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1000)
+        with self._lock:
+            self._subscribers.add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        with self._lock:
+            self._subscribers = {s for s in self._subscribers if s[1] is not queue}
+
+    def _publish(self, event: str, entry: PresenceEntry) -> None:
+        payload = {
+            "event": event,
+            "key_id": entry.key_id,
+            "key": entry.key,
+            "machine_id": entry.machine_id,
+            "last_seen": entry.last_seen.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            # touch/tick có thể chạy ngoài event loop (thread của scheduler)
+            loop.call_soon_threadsafe(_offer, queue, payload)
+
+def _offer(queue: asyncio.Queue, payload: dict) -> None:
+    # Trang giám sát quá chậm thì bỏ qua sự kiện thay vì để hàng đợi phình ra
+    if not queue.full():
+        queue.put_nowait(payload)
+
+registry = PresenceRegistry(timeout_sec=settings.HEARTBEAT_TIMEOUT_SEC)
+
+def touch(key_id: int, key: str, machine_id: str | None, seen_at: datetime | None = None) -> None:
+    """Ghi nhận key online trong worker này và báo cho các worker khác (gom theo key qua bus)."""
+    seen_at = seen_at or datetime.now(timezone.utc)
+    registry.touch(key_id, key, machine_id, seen_at)
+    bus.publish_coalesced("presence.touch", key_id, [key_id, key, machine_id, seen_at.isoformat()])
+
+def _apply_remote_touches(items: list) -> None:
+    for key_id, key, machine_id, seen_at in items:
+        registry.touch(key_id, key, machine_id, datetime.fromisoformat(seen_at))
+
+bus.subscribe("presence.touch", _apply_remote_touches)
+
+async def run_ticker() -> None:
+    """Vòng lặp tick của timing wheel, chạy như một task nền trong lifespan."""
+    next_tick = time.monotonic()
+    while True:
+        next_tick += registry.tick_sec
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+        registry.tick()
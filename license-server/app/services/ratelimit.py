@@ -0,0 +1,194 @@
+# app/services/ratelimit.py
+
+from __future__ import annotations
+import threading
+import time
+from collections import Counter, OrderedDict
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+from .. import bus, models
+from ..config import settings
+
+class TokenBucketLimiter:
+    """
+    Token bucket theo từng định danh (IP, machine_id, tiền tố key).
+    Số bucket bị giới hạn bởi `max_entries` (LRU): bucket lâu không dùng bị bỏ trước,
+    và một bucket nhàn rỗi đủ lâu cũng đã đầy lại, nên bỏ nó không làm lỏng giới hạn.
+    """
+
+    def __init__(self, rate_per_sec: float, burst: float, max_entries: int):
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self.max_entries = max_entries
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _bucket(self, identity: str, now: float) -> list[float]:
+        bucket = self._buckets.get(identity)
+        if bucket is None:
+            bucket = [self.burst, now]
+            self._buckets[identity] = bucket
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(identity)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate_per_sec)
+            bucket[1] = now
+        return bucket
+
+    def allow(self, identity: str, cost: float = 1.0) -> bool:
+        """Trừ `cost` token nếu còn đủ; trả về False nếu định danh đang bị giới hạn."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(identity, now)
+            if bucket[0] < cost:
+                self.rejected += 1
+                return False
+            bucket[0] -= cost
+            return True
+
+    def take(self, identity: str, requested: int) -> int:
+        """Trừ tối đa `requested` token (mỗi token một đơn vị công việc); trả về số token đã cấp (0 nếu đang bị giới hạn)."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(identity, now)
+            granted = min(requested, int(bucket[0])) if bucket[0] >= 1 else 0
+            if granted == 0:
+                self.rejected += 1
+            bucket[0] -= granted
+            return granted
+
+    def penalize(self, identity: str, cost: float) -> None:
+        """Trừ thêm token (có thể âm) sau một lần thất bại, để kẻ dò key bị chặn nhanh hơn."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(identity, now)
+            bucket[0] = max(-self.burst, bucket[0] - cost)
+
+    def retry_after(self, identity: str) -> int:
+        """Số giây (làm tròn lên) cho đến khi định danh có lại một token."""
+        with self._lock:
+            bucket = self._buckets.get(identity)
+            missing = 1.0 - bucket[0] if bucket else 0.0
+        return max(1, int(missing / self.rate_per_sec + 0.999)) if missing > 0 else 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._buckets)
+
+def _limiter(per_min: float, burst: float) -> TokenBucketLimiter:
+    return TokenBucketLimiter(per_min / 60.0, burst, settings.RATE_LIMIT_MAX_ENTRIES)
+
+ip_limiter = _limiter(settings.RATE_LIMIT_IP_PER_MIN, settings.RATE_LIMIT_IP_BURST)
+machine_limiter = _limiter(settings.RATE_LIMIT_MACHINE_PER_MIN, settings.RATE_LIMIT_MACHINE_BURST)
+key_prefix_limiter = _limiter(settings.RATE_LIMIT_KEY_PREFIX_PER_MIN, settings.RATE_LIMIT_KEY_PREFIX_BURST)
+
+def key_prefix(key_value: str) -> str:
+    """Nhóm đầu của key (ví dụ 'ABCDE' trong 'ABCDE-...'), dùng để giới hạn việc dò một dải key."""
+    return key_value.strip().upper().split("-", 1)[0][:5]
+
+def _limit_by_ip(client_ip: str | None) -> bool:
+    # Chỉ giới hạn theo IP khi địa chỉ là IP thật của client (xem RATE_LIMIT_BY_IP trong config)
+    return settings.RATE_LIMIT_BY_IP and bool(client_ip)
+
+def _identities(client_ip: str | None, machine_id: str, key_value: str) -> list[tuple[TokenBucketLimiter, str]]:
+    pairs = [(ip_limiter, client_ip)] if _limit_by_ip(client_ip) else []
+    return pairs + [
+        (machine_limiter, machine_id),
+        (key_prefix_limiter, key_prefix(key_value)),
+    ]
+
+def _check(pairs: list[tuple[TokenBucketLimiter, str]]) -> int | None:
+    for limiter, identity in pairs:
+        if not limiter.allow(identity):
+            return limiter.retry_after(identity)
+    return None
+
+def check_request(client_ip: str | None, machine_id: str, key_value: str) -> int | None:
+    """
+    Kiểm tra cả ba giới hạn trước khi chạm DB.
+    Trả về None nếu được phép, hoặc số giây Retry-After nếu bị từ chối.
+    """
+    return _check(_identities(client_ip, machine_id, key_value))
+
+def admit_client(client_ip: str | None, count: int) -> tuple[int, int | None]:
+    """
+    Trừ giới hạn theo IP cho từng mục của yêu cầu hàng loạt (trước khi chạm DB), như khi gửi
+    `count` yêu cầu /activate riêng lẻ. Trả về (số mục đầu tiên được xử lý, Retry-After nếu không mục nào được nhận).
+    """
+    if not _limit_by_ip(client_ip):
+        return count, None
+    granted = ip_limiter.take(client_ip, count)
+    return granted, None if granted else ip_limiter.retry_after(client_ip)
+
+def check_entry(machine_id: str, key_value: str) -> int | None:
+    """Kiểm tra giới hạn theo máy và dải key cho từng mục của yêu cầu hàng loạt."""
+    return _check(_identities(None, machine_id, key_value))
+
+def _penalize(client_ip: str | None, machine_id: str, key_value: str, count: int = 1) -> None:
+    for limiter, identity in _identities(client_ip, machine_id, key_value):
+        limiter.penalize(identity, settings.RATE_LIMIT_FAILURE_COST * count)
+
+def record_failure(client_ip: str | None, machine_id: str, key_value: str) -> None:
+    """
+    Phạt thêm các định danh của một yêu cầu kích hoạt bị từ chối, ở mọi worker (qua bus):
+    kẻ dò key không né được giới hạn bằng cách rải yêu cầu sang các worker khác nhau.
+    """
+    _penalize(client_ip, machine_id, key_value)
+    bus.publish_coalesced(
+        "ratelimit.penalty", (client_ip, machine_id, key_value),
+        [client_ip, machine_id, key_value, 1], merge=lambda old, new: old[:3] + [old[3] + new[3]],
+    )
+
+def _apply_remote_penalties(items: list) -> None:
+    for client_ip, machine_id, key_value, count in items:
+        _penalize(client_ip, machine_id, key_value, count)
+
+bus.subscribe("ratelimit.penalty", _apply_remote_penalties)
+
+class FailedAttemptCounter:
+    """Cộng dồn số lần thất bại theo key trong bộ nhớ, xả xuống DB theo lô."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Counter[int] = Counter()
+
+    def add(self, key_id: int, count: int = 1) -> None:
+        with self._lock:
+            self._counts[key_id] += count
+
+    def drain(self) -> Counter[int]:
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        return counts
+
+    def restore(self, counts: Counter[int]) -> None:
+        with self._lock:
+            self._counts.update(counts)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._counts)
+
+failed_attempts = FailedAttemptCounter()
+
+def flush_failed_attempts(db: Session) -> int:
+    """Ghi các bộ đếm đã cộng dồn bằng UPDATE executemany. Trả về số key đã cập nhật."""
+    counts = failed_attempts.drain()
+    if not counts:
+        return 0
+    table = models.Key.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(failed_attempts=table.c.failed_attempts + bindparam("b_count"))
+    )
+    try:
+        db.execute(stmt, [{"b_id": key_id, "b_count": count} for key_id, count in counts.items()])
+        db.commit()
+    except Exception:
+        db.rollback()
+        failed_attempts.restore(counts)
+        raise
+    return len(counts)
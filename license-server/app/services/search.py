@@ -0,0 +1,149 @@
+# app/services/search.py
+
+from __future__ import annotations
+import re
+import threading
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.orm import Session
+from .. import models
+
+NGRAM_SIZE = 3
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+# Số id ứng viên lấy từ index trong mỗi câu truy vấn IN (...)
+_FETCH_CHUNK = 500
+
+_NON_ALNUM = re.compile(r"[^0-9A-Z]")
+
+def normalize(text: str) -> str:
+    """Chuẩn hóa chuỗi key để so khớp: viết hoa, bỏ dấu '-' và ký tự không phải chữ/số."""
+    return _NON_ALNUM.sub("", text.upper())
+
+def _ngrams(text: str) -> set[str]:
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+class NgramIndex:
+    """
+    Chỉ mục đảo n-gram trong bộ nhớ trên chuỗi key đã chuẩn hóa.
+    Dùng cho SQLite (và làm phương án dự phòng) thay cho quét ILIKE toàn bảng.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._keys: dict[int, str] = {}
+        self._postings: dict[str, set[int]] = {}
+
+    def ensure_loaded(self, db: Session) -> None:
+        """Nạp index từ DB ở lần dùng đầu tiên (chỉ đọc cột id và key)."""
+        if self._loaded:
+            return
+        # Đọc DB ngoài khóa: với AsyncSession.run_sync, I/O nhường event loop giữa chừng,
+        # giữ threading.Lock lúc đó có thể làm treo chính thread của event loop.
+        rows = db.execute(select(models.Key.id, models.Key.key)).all()
+        with self._lock:
+            if self._loaded:
+                return
+            for key_id, key_value in rows:
+                self._add_locked(key_id, key_value)
+            self._loaded = True
+
+    def _add_locked(self, key_id: int, key_value: str) -> None:
+        normalized = normalize(key_value)
+        self._keys[key_id] = normalized
+        for gram in _ngrams(normalized):
+            self._postings.setdefault(gram, set()).add(key_id)
+
+    def add(self, key_id: int, key_value: str) -> None:
+        with self._lock:
+            self._add_locked(key_id, key_value)
+
+    def remove(self, key_id: int) -> None:
+        with self._lock:
+            normalized = self._keys.pop(key_id, None)
+            if normalized is None:
+                return
+            for gram in _ngrams(normalized):
+                ids = self._postings.get(gram)
+                if ids is not None:
+                    ids.discard(key_id)
+                    if not ids:
+                        del self._postings[gram]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys.clear()
+            self._postings.clear()
+            self._loaded = False
+
+    def search(self, term: str, prefix: bool = False) -> list[int]:
+        """Trả về id các key khớp `term` (đã chuẩn hóa), sắp xếp theo id giảm dần."""
+        with self._lock:
+            if len(term) < NGRAM_SIZE:
+                candidates = self._keys.keys()
+            else:
+                postings = sorted((self._postings.get(g, set()) for g in _ngrams(term)), key=len)
+                candidates = set.intersection(*postings) if postings[0] else set()
+            if prefix:
+                matched = [i for i in candidates if self._keys[i].startswith(term)]
+            else:
+                matched = [i for i in candidates if term in self._keys[i]]
+        matched.sort(reverse=True)
+        return matched
+
+key_index = NgramIndex()
+
+def index_add(key_id: int, key_value: str) -> None:
+    """Cập nhật index khi có key mới."""
+    key_index.add(key_id, key_value)
+
+def index_remove(key_id: int) -> None:
+    """Cập nhật index khi key bị xóa."""
+    key_index.remove(key_id)
+
+def _normalized_key_column():
+    # Phải trùng với biểu thức của index trigram trong models.py;
+    # dùng literal để planner của Postgres khớp được index (kể cả với prepared statement).
+    return func.replace(models.Key.key, literal_column("'-'"), literal_column("''"))
+
+def search_keys(
+    db: Session,
+    term: str,
+    status: models.KeyStatus | None = None,
+    prefix: bool = False,
+    limit: int = DEFAULT_LIMIT,
+) -> list[models.Key]:
+    """
+    Tìm key theo chuỗi con (hoặc tiền tố) không phân biệt dấu '-', có lọc theo trạng thái.
+    Postgres dùng index trigram; các DB khác dùng index n-gram trong bộ nhớ.
+    """
+    normalized = normalize(term)
+    query = db.query(models.Key)
+    if status is not None:
+        query = query.filter(models.Key.status == status)
+    if not normalized:
+        return query.order_by(models.Key.id.desc()).limit(limit).all()
+
+    if db.get_bind().dialect.name == "postgresql":
+        pattern = f"{normalized}%" if prefix else f"%{normalized}%"
+        return (
+            query.filter(_normalized_key_column().like(pattern))
+            .order_by(models.Key.id.desc())
+            .limit(limit)
+            .all()
+        )
+
+    key_index.ensure_loaded(db)
+    candidate_ids = key_index.search(normalized, prefix=prefix)
+    found: list[models.Key] = []
+    for start in range(0, len(candidate_ids), _FETCH_CHUNK):
+        chunk = candidate_ids[start:start + _FETCH_CHUNK]
+        found.extend(
+            query.filter(models.Key.id.in_(chunk))
+            .order_by(models.Key.id.desc())
+            .limit(limit - len(found))
+            .all()
+        )
+        if len(found) >= limit:
+            break
+    return found
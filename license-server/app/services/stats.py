@@ -0,0 +1,170 @@
+# app/services/stats.py
+
+from __future__ import annotations
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import delete, func, insert, or_, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from .. import models
+
+STATUS_PREFIX = "status:"
+EXPIRY_PREFIX = "expires:"
+# Dòng phiên bản của bảng key: tăng trong cùng transaction với mỗi lần ghi key,
+# nên mọi worker đọc ra cùng một giá trị (dùng làm ETag cho các trang/API đọc bảng key)
+VERSION_BUCKET = "version:keys"
+# Trạng thái còn hiệu lực: chỉ các key này được tính vào số key sắp hết hạn
+LIVE_STATUSES = (models.KeyStatus.unused, models.KeyStatus.active, models.KeyStatus.used)
+# Cửa sổ "sắp hết hạn": số ngày UTC tính cả hôm nay ("day" = hết hạn trong hôm nay, "week" = hôm nay và 6 ngày tới)
+EXPIRING_WINDOWS = {"day": 1, "week": 7, "month": 30}
+
+def _dialect_name(db) -> str:
+    # Nhận cả Session lẫn Connection (migration chạy trên Connection)
+    return db.dialect.name if hasattr(db, "dialect") else db.get_bind().dialect.name
+
+def _status_bucket(status) -> str:
+    return STATUS_PREFIX + models.KeyStatus(status).value
+
+def _expiry_bucket(day: date | str) -> str:
+    return EXPIRY_PREFIX + (day if isinstance(day, str) else day.isoformat())
+
+def _expiry_day(value: datetime | None) -> date | None:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).date()
+
+class StatsDelta:
+    """Thay đổi cần cộng vào key_stats, gom lại rồi ghi một lần trước khi commit."""
+
+    def __init__(self):
+        self.counts: Counter[str] = Counter()
+        # Có dòng key nào thay đổi không (kể cả khi các bucket bù trừ nhau về 0)
+        self.touched = False
+
+    def add(self, status, expiry_date: datetime | None, n: int = 1) -> "StatsDelta":
+        if n:
+            self.touched = True
+        self.counts[_status_bucket(status)] += n
+        day = _expiry_day(expiry_date)
+        if day is not None and models.KeyStatus(status) in LIVE_STATUSES:
+            self.counts[_expiry_bucket(day)] += n
+        return self
+
+    def remove(self, status, expiry_date: datetime | None, n: int = 1) -> "StatsDelta":
+        return self.add(status, expiry_date, -n)
+
+    def move(self, old_status, old_expiry: datetime | None, new_status, new_expiry: datetime | None) -> "StatsDelta":
+        return self.remove(old_status, old_expiry).add(new_status, new_expiry)
+
+def apply_delta(db: Session, delta: StatsDelta) -> None:
+    """
+    Cộng dồn `delta` vào key_stats bằng upsert, trong transaction hiện tại (người gọi commit).
+    Các bucket được ghi theo thứ tự cố định để các transaction đồng thời không deadlock trên Postgres.
+    Có dòng key thay đổi thì tăng luôn VERSION_BUCKET.
+    """
+    counts = {bucket: n for bucket, n in delta.counts.items() if n}
+    if delta.touched:
+        counts[VERSION_BUCKET] = 1
+    rows = [{"bucket": bucket, "count": n} for bucket, n in sorted(counts.items())]
+    if not rows:
+        return
+    table = models.KeyStat.__table__
+    dialect = _dialect_name(db)
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (postgresql if dialect == "postgresql" else sqlite).insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["bucket"], set_={"count": table.c.count + stmt.excluded["count"]}
+        )
+        db.execute(stmt, rows)
+        return
+    for row in rows:
+        updated = db.execute(
+            update(table).where(table.c.bucket == row["bucket"]).values(count=table.c.count + row["count"])
+        )
+        if updated.rowcount == 0:
+            db.execute(insert(table).values(**row))
+
+def data_version(db: Session) -> int:
+    """Phiên bản hiện tại của bảng key (0 nếu chưa có lần ghi nào); một lần tra theo khóa chính."""
+    table = models.KeyStat.__table__
+    return db.execute(select(table.c.count).where(table.c.bucket == VERSION_BUCKET)).scalar() or 0
+
+def _count_buckets(db) -> dict[str, int]:
+    """Đếm lại toàn bộ từ bảng key (quét cả bảng; chỉ dùng cho reconcile và migration)."""
+    key = models.Key
+    if _dialect_name(db) == "postgresql":
+        expiry_day = func.date(func.timezone("UTC", key.expiry_date))
+    else:
+        expiry_day = func.date(key.expiry_date)
+    counts: dict[str, int] = {}
+    for status, n in db.execute(select(key.status, func.count()).group_by(key.status)):
+        counts[_status_bucket(status)] = n
+    for day, n in db.execute(
+        select(expiry_day, func.count())
+        .where(key.expiry_date.isnot(None), key.status.in_(LIVE_STATUSES))
+        .group_by(expiry_day)
+    ):
+        counts[_expiry_bucket(day if isinstance(day, str) else day.isoformat())] = n
+    return counts
+
+def rebuild(db) -> dict[str, int]:
+    """Ghi lại key_stats từ đầu (giữ nguyên VERSION_BUCKET), trong transaction hiện tại. Trả về các bucket đã ghi."""
+    counts = _count_buckets(db)
+    table = models.KeyStat.__table__
+    db.execute(delete(table).where(table.c.bucket != VERSION_BUCKET))
+    if counts:
+        db.execute(insert(table), [{"bucket": b, "count": n} for b, n in sorted(counts.items())])
+    return counts
+
+def reconcile(db: Session) -> int:
+    """
+    Sửa sai lệch (nếu có) giữa key_stats và bảng key, đồng thời bỏ các bucket ngày đã qua.
+    Trên Postgres khóa key_stats trong lúc đếm để các delta đồng thời chờ tới sau khi ghi xong.
+    Trả về số bucket bị lệch.
+    """
+    table = models.KeyStat.__table__
+    try:
+        if _dialect_name(db) == "postgresql":
+            db.execute(text("LOCK TABLE key_stats IN SHARE ROW EXCLUSIVE MODE"))
+        stored = dict(db.execute(
+            select(table.c.bucket, table.c.count).where(table.c.bucket != VERSION_BUCKET)
+        ).all())
+        counts = rebuild(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    today = _expiry_bucket(datetime.now(timezone.utc).date())
+    drift = 0
+    for bucket in set(stored) | set(counts):
+        # Bucket ngày đã qua bị bỏ đi theo lịch, không tính là lệch
+        if bucket.startswith(EXPIRY_PREFIX) and bucket < today:
+            continue
+        if stored.get(bucket, 0) != counts.get(bucket, 0):
+            drift += 1
+    return drift
+
+def summary(db: Session) -> dict:
+    """Số key theo trạng thái và số key sắp hết hạn; chỉ đọc vài chục dòng của key_stats."""
+    table = models.KeyStat.__table__
+    today = datetime.now(timezone.utc).date()
+    last_day = today + timedelta(days=max(EXPIRING_WINDOWS.values()) - 1)
+    rows = db.execute(
+        select(table.c.bucket, table.c.count).where(or_(
+            table.c.bucket.like(STATUS_PREFIX + "%"),
+            table.c.bucket.between(_expiry_bucket(today), _expiry_bucket(last_day)),
+        ))
+    ).all()
+    by_status = {status.value: 0 for status in models.KeyStatus}
+    expiring = {name: 0 for name in EXPIRING_WINDOWS}
+    for bucket, n in rows:
+        if bucket.startswith(STATUS_PREFIX):
+            by_status[bucket[len(STATUS_PREFIX):]] = n
+            continue
+        days_left = (date.fromisoformat(bucket[len(EXPIRY_PREFIX):]) - today).days
+        for name, window in EXPIRING_WINDOWS.items():
+            if days_left < window:
+                expiring[name] += n
+    return {"total": sum(by_status.values()), "by_status": by_status, "expiring": expiring}
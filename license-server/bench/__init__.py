@@ -0,0 +1,11 @@
+# bench/__init__.py
+
+"""
+Bộ benchmark tái lập được cho license server.
+Chạy app FastAPI ngay trong tiến trình (ASGI, không qua mạng) trên một DB SQLite sinh sẵn
+(hoặc Postgres cục bộ), đo throughput, p50/p95/p99 và số truy vấn mỗi request.
+
+    pip install -r bench/requirements.txt
+    python -m bench --keys 100000 --concurrency 32 --save bench/baseline.json
+    python -m bench --keys 100000 --concurrency 32 --compare bench/baseline.json
+"""
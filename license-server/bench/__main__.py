@@ -0,0 +1,169 @@
+# bench/__main__.py
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+from .dataset import RUN_DATABASE, Samples, load_samples, prepare
+from .scenarios import SCENARIOS
+
+_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def _configure_environment(database_url: str) -> None:
+    """Phải gọi trước khi import app: Settings đọc biến môi trường lúc import."""
+    os.environ["DATABASE_URL"] = database_url
+    # Server-Timing cho biết số truy vấn của từng request (xem app/metrics.py)
+    os.environ["METRICS_ENABLED"] = "true"
+    os.environ["SERVER_TIMING_ENABLED"] = "true"
+    os.environ["SLOW_QUERY_MS"] = "1000000"
+    # Mọi request đến từ cùng một "client", nên nới giới hạn tần suất để đo chính server
+    for name in ("IP", "MACHINE", "KEY_PREFIX"):
+        os.environ[f"RATE_LIMIT_{name}_PER_MIN"] = "1e12"
+        os.environ[f"RATE_LIMIT_{name}_BURST"] = "1e12"
+
+async def run_scenario(client, scenario, samples: Samples, requests: int, concurrency: int, warmup: int, seed: int) -> dict:
+    """Chạy `requests` request với `concurrency` worker đồng thời và tổng hợp kết quả."""
+    for i in range(warmup):
+        await scenario.send(client, random.Random(seed - i - 1), samples)
+
+    latencies: list[float] = []
+    queries: list[int] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker(worker_id: int) -> None:
+        nonlocal errors
+        rng = random.Random(seed * 1000 + worker_id)
+        for _ in counter:
+            started = time.perf_counter()
+            response = await scenario.send(client, rng, samples)
+            latencies.append(time.perf_counter() - started)
+            match = _QUERIES.search(response.headers.get("server-timing", ""))
+            if match:
+                queries.append(int(match.group(1)))
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+async def run(args, database_url: str) -> dict:
+    import httpx
+    from app import database
+    from app.main import app
+
+    samples = load_samples(database_url, args.seed)
+    results: dict[str, dict] = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.scenarios:
+                scenario = SCENARIOS[name]
+                print(f"-> {name}: {scenario.description}")
+                results[name] = await run_scenario(
+                    client, scenario, samples, args.requests, args.concurrency, args.warmup, args.seed
+                )
+                _print_result(name, results[name])
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "keys": args.keys,
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "database": database.engine.dialect.name if database.engine is not None else database_url.split(":", 1)[0],
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "scenarios": results,
+    }
+
+def _print_result(name: str, r: dict) -> None:
+    print(
+        f"   {name:<12} {r['throughput_rps']:>9.1f} req/s  p50 {r['p50_ms']:>8.2f} ms  "
+        f"p95 {r['p95_ms']:>8.2f} ms  p99 {r['p99_ms']:>8.2f} ms  "
+        f"queries/req {r['queries_per_request']}  errors {r['errors']}"
+    )
+
+def compare(current: dict, baseline: dict, tolerance: float) -> bool:
+    """In chênh lệch so với baseline; trả về False nếu có kịch bản chậm đi quá `tolerance`."""
+    ok = True
+    print(f"\nCompared with baseline from {baseline['meta'].get('created_at')} (tolerance {tolerance:.0%}):")
+    for name, r in current["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print(f"   {name:<12} (not in baseline)")
+            continue
+        rps_delta = (r["throughput_rps"] - base["throughput_rps"]) / base["throughput_rps"] if base["throughput_rps"] else 0.0
+        p95_delta = (r["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        regressed = rps_delta < -tolerance or p95_delta > tolerance
+        ok = ok and not regressed
+        print(
+            f"   {name:<12} throughput {rps_delta:+7.1%}  p95 {p95_delta:+7.1%}  "
+            f"queries/req {base['queries_per_request']} -> {r['queries_per_request']}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return ok
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="License server benchmark suite.")
+    parser.add_argument("--keys", type=int, default=10_000, help="số key trong DB (ví dụ 10000, 100000, 1000000)")
+    parser.add_argument("--database-url", help="Postgres cục bộ thay cho SQLite sinh sẵn (dữ liệu được giữ lại)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="danh sách kịch bản, phân cách bằng dấu phẩy")
+    parser.add_argument("--requests", type=int, default=2000, help="số request đo cho mỗi kịch bản")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="lưu kết quả thành file JSON (baseline)")
+    parser.add_argument("--compare", help="so sánh với một file baseline JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="mức chậm đi tối đa cho phép khi so sánh")
+    args = parser.parse_args(argv)
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}; choose from {', '.join(SCENARIOS)}")
+
+    _configure_environment(args.database_url or f"sqlite:///{RUN_DATABASE}")
+    database_url = prepare(args.keys, args.seed, args.database_url)
+    report = asyncio.run(run(args, database_url))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# bench/dataset.py
+
+from __future__ import annotations
+import os
+import random
+import shutil
+import string
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, func, insert, select
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), ".data")
+RUN_DATABASE = os.path.join(DATA_DIR, "run.db")
+INSERT_BATCH = 10_000
+_KEY_CHARS = string.ascii_uppercase + string.digits
+# Tỉ lệ trạng thái của dữ liệu mẫu (phần còn lại là 'active')
+_STATUS_WEIGHTS = (("used", 0.60), ("revoked", 0.05), ("expired", 0.05), ("unused", 0.05))
+
+@dataclass
+class Samples:
+    """Một phần dữ liệu đã sinh, dùng để tạo request cho các kịch bản."""
+    used: list[tuple[str, str]]
+    keys: list[str]
+    max_id: int
+
+def _random_key(rng: random.Random) -> str:
+    chars = "".join(rng.choices(_KEY_CHARS, k=25))
+    return "-".join(chars[i:i + 5] for i in range(0, 25, 5))
+
+def _pick_status(rng: random.Random) -> str:
+    roll = rng.random()
+    for status, weight in _STATUS_WEIGHTS:
+        if roll < weight:
+            return status
+        roll -= weight
+    return "active"
+
+def _populate(database_url: str, size: int, seed: int) -> None:
+    """Sinh `size` key (tất định theo `seed`) bằng các câu INSERT theo lô."""
+    from app import models
+    from app.schema import bootstrap_schema
+    from app.services import stats
+
+    engine = create_engine(database_url)
+    try:
+        bootstrap_schema(engine)
+        table = models.Key.__table__
+        with engine.begin() as conn:
+            existing = conn.execute(select(func.count()).select_from(table)).scalar_one()
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc)
+        remaining = size - existing
+        print(f"Generating {remaining} key(s) in {database_url} ...")
+        while remaining > 0:
+            rows = []
+            for _ in range(min(remaining, INSERT_BATCH)):
+                status = _pick_status(rng)
+                used = status == "used"
+                expired = status == "expired"
+                rows.append({
+                    "key": _random_key(rng),
+                    "status": status,
+                    "expiry_date": now + timedelta(days=rng.randint(-30 if expired else 1, -1 if expired else 365)),
+                    "machine_id": f"bench-machine-{rng.getrandbits(48):x}" if used else None,
+                    "username": "bench" if used else None,
+                    "last_activated_at": now - timedelta(seconds=rng.randint(0, 86400)) if used else None,
+                })
+            with engine.begin() as conn:
+                conn.execute(insert(table), rows)
+            remaining -= len(rows)
+        # Dữ liệu được chèn thẳng, không qua services/keys.py, nên đếm lại bảng tổng hợp
+        with engine.begin() as conn:
+            stats.rebuild(conn)
+    finally:
+        engine.dispose()
+
+def prepare(size: int, seed: int, database_url: str | None = None) -> str:
+    """
+    Chuẩn bị DB cho một lần chạy và trả về chuỗi kết nối.
+    SQLite: sinh một bản mẫu (lưu lại trong bench/.data cho các lần sau) rồi chép ra bản chạy,
+    để kịch bản ghi (bulk create, activate) không làm thay đổi dữ liệu của lần chạy sau.
+    Postgres: chỉ bổ sung cho đủ `size` key trong DB được chỉ định.
+    """
+    if database_url:
+        _populate(database_url, size, seed)
+        return database_url
+    os.makedirs(DATA_DIR, exist_ok=True)
+    template = os.path.join(DATA_DIR, f"keys-{size}-{seed}.db")
+    if not os.path.exists(template):
+        partial = template + ".partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        _populate(f"sqlite:///{partial}", size, seed)
+        os.replace(partial, template)
+    shutil.copyfile(template, RUN_DATABASE)
+    return f"sqlite:///{RUN_DATABASE}"
+
+def load_samples(database_url: str, seed: int, limit: int = 10_000) -> Samples:
+    """Đọc một mẫu key (ngẫu nhiên nhưng tất định) để dựng request."""
+    from app import models
+
+    engine = create_engine(database_url)
+    table = models.Key.__table__
+    try:
+        with engine.connect() as conn:
+            max_id = conn.execute(select(func.max(table.c.id))).scalar_one() or 0
+            rng = random.Random(seed)
+            ids = sorted({rng.randint(1, max_id) for _ in range(limit)}) if max_id else []
+            rows = []
+            for start in range(0, len(ids), 900):
+                rows.extend(conn.execute(
+                    select(table.c.key, table.c.status, table.c.machine_id)
+                    .where(table.c.id.in_(ids[start:start + 900]))
+                ).all())
+    finally:
+        engine.dispose()
+    return Samples(
+        used=[(row.key, row.machine_id) for row in rows if row.status == models.KeyStatus.used],
+        keys=[row.key for row in rows],
+        max_id=max_id,
+    )
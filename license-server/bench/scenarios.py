@@ -0,0 +1,56 @@
+# bench/scenarios.py
+
+from __future__ import annotations
+import random
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+import httpx
+from .dataset import Samples
+
+RequestFn = Callable[[httpx.AsyncClient, random.Random, Samples], Awaitable[httpx.Response]]
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    description: str
+    send: RequestFn
+
+async def _activate_revalidate(client: httpx.AsyncClient, rng: random.Random, samples: Samples) -> httpx.Response:
+    key, machine_id = rng.choice(samples.used)
+    return await client.post("/activate", json={"key": key, "machine_id": machine_id, "username": "bench"})
+
+async def _heartbeat(client: httpx.AsyncClient, rng: random.Random, samples: Samples) -> httpx.Response:
+    key, machine_id = rng.choice(samples.used)
+    return await client.post("/heartbeat", json={"key": key, "machine_id": machine_id})
+
+async def _admin_list(client: httpx.AsyncClient, rng: random.Random, samples: Samples) -> httpx.Response:
+    # Trang đầu hoặc một trang ngẫu nhiên theo con trỏ keyset
+    if rng.random() < 0.5:
+        return await client.get("/api/admin/keys", params={"limit": 50})
+    return await client.get("/api/admin/keys", params={"limit": 50, "after_id": rng.randint(1, samples.max_id + 1)})
+
+async def _admin_page(client: httpx.AsyncClient, rng: random.Random, samples: Samples) -> httpx.Response:
+    return await client.get("/admin/keys")
+
+async def _htmx_search(client: httpx.AsyncClient, rng: random.Random, samples: Samples) -> httpx.Response:
+    key = rng.choice(samples.keys).replace("-", "")
+    start = rng.randint(0, len(key) - 4)
+    return await client.post(
+        "/admin/keys/search",
+        data={"search": key[start:start + 4], "status": "", "limit": "50"},
+        headers={"HX-Request": "true"},
+    )
+
+async def _bulk_create(client: httpx.AsyncClient, rng: random.Random, samples: Samples) -> httpx.Response:
+    return await client.post("/api/admin/keys/bulk", json={"count": 100})
+
+SCENARIOS: dict[str, Scenario] = {
+    s.name: s for s in (
+        Scenario("activate", "/activate re-validation of keys already bound to their machine", _activate_revalidate),
+        Scenario("heartbeat", "/heartbeat storm from bound machines", _heartbeat),
+        Scenario("admin_list", "/api/admin/keys keyset pages", _admin_list),
+        Scenario("admin_page", "/admin/keys full HTML page", _admin_page),
+        Scenario("search", "HTMX search on 4-character key fragments", _htmx_search),
+        Scenario("bulk_create", "/api/admin/keys/bulk with 100 keys per request", _bulk_create),
+    )
+}